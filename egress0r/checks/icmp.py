@@ -1,14 +1,31 @@
-import random
-
-from scapy.all import ICMP, IP, ICMPv6EchoRequest, IPv6, Raw, sr1
+import collections
+import functools
+import time
 
+from egress0r import ratelimit, rtt
+from egress0r.engines import ICMPEngine
 from egress0r.message import InfoMessage, NegativeMessage, PositiveMessage
 from egress0r.utils import is_ipv4_addr, is_ipv6_addr
 
+ExfilResult = collections.namedtuple("ExfilResult", ["echoed", "total", "elapsed"])
+ICMPResult = collections.namedtuple(
+    "ICMPResult", ["reachable", "payload_size", "echo_stats", "exfil"]
+)
+
 
 class ICMPCheck:
+    """Check if ICMP echo requests to the target hosts are answered and if data
+    can be exfiltrated in their payload. All targets are probed at once.
+    """
 
     DEFAULT_TIMEOUT = 5
+    DEFAULT_HEDGES = 0
+    DEFAULT_EXFIL_WINDOW = 1
+    DEFAULT_EXFIL_RETRIES = 0
+    VALID_BACKENDS = ICMPEngine.VALID_BACKENDS
+    DEFAULT_BACKEND = ICMPEngine.DEFAULT_BACKEND
+    DEFAULT_DISCOVER_PAYLOAD_SIZE = False
+    DEFAULT_BURST = 0
     START_MESSAGE = "Performing ICMP related checks..."
 
     def __init__(
@@ -18,156 +35,174 @@ class ICMPCheck:
         exfil_payload=None,
         with_ipv4=True,
         with_ipv6=True,
+        hedges=DEFAULT_HEDGES,
+        hedge_delay=None,
+        exfil_window=DEFAULT_EXFIL_WINDOW,
+        exfil_retries=DEFAULT_EXFIL_RETRIES,
+        backend=DEFAULT_BACKEND,
+        discover_payload_size=DEFAULT_DISCOVER_PAYLOAD_SIZE,
+        max_payload_size=None,
+        burst=DEFAULT_BURST,
     ):
+        if backend not in self.VALID_BACKENDS:
+            raise ValueError(
+                f"ICMPCheck expects argument backend to be one of "
+                f"{self.VALID_BACKENDS}, got {backend!r}"
+            )
         self.target_hosts = target_hosts
         self.exfil_payload = exfil_payload
         self.timeout = timeout
         self._with_ipv4 = with_ipv4
         self._with_ipv6 = with_ipv6
-
-    @staticmethod
-    def _random_icmp_id():
-        """Generate a random ICMP id value."""
-        return random.randint(1, 32767)
-
-    def _send_packet(self, pkt):
-        return sr1(pkt, verbose=False, timeout=self.timeout)
-
-    def _ping_ipv4(self, target):
-        """Request an ICMP Echo Reply from the target host via IPv4.
-        Returns bool if the target responded.
-        """
-        random_id = self._random_icmp_id()
-        packet = IP(dst=target) / ICMP(id=random_id)
-        try:
-            answer = self._send_packet(packet)
-            return answer.payload.id == random_id
-        except (TypeError, ValueError, AttributeError, KeyError):
-            pass
-        return False
-
-    def _ping_ipv6(self, target):
-        """Request an ICMP echo reply from the target host via IPv6.
-        Returns bool if the target responded.
+        self.hedges = hedges
+        self.hedge_delay = hedge_delay
+        self.exfil_window = exfil_window
+        self.exfil_retries = exfil_retries
+        self.backend = backend
+        self.discover_payload_size = discover_payload_size
+        self.max_payload_size = max_payload_size
+        self.burst = burst
+        self.results = {}
+        self.stats = rtt.LossStats()
+
+    def _engine(self):
+        return ICMPEngine(
+            self.timeout,
+            estimators=functools.partial(rtt.get, "icmp"),
+            limiter=ratelimit.get(),
+            hedges=self.hedges,
+            hedge_delay=self.hedge_delay,
+            stats=self.stats,
+            backend=self.backend,
+            dont_fragment=self.discover_payload_size,
+        )
+
+    def _ping_all(self, engine, targets):
+        """Ping all targets at once, returns a dict of target -> bool."""
+        replies = engine.ping(targets)
+        return {target: echo is not None for target, echo in replies.items()}
+
+    def _exfil_all(self, engine, targets, payload, chunk_sizes=None):
         """
-        random_id = self._random_icmp_id()
-        packet = IPv6(dst=target) / ICMPv6EchoRequest(id=random_id)
-        try:
-            answer = self._send_packet(packet)
-            return answer.payload.id == random_id
-        except (TypeError, ValueError, AttributeError, KeyError):
-            pass
-        return False
+        Exfiltrate the payload to all targets via ICMP echo requests.
 
-    def _exfil_ipv4(self, target, payload):
-        """
-        Exfiltrate the payload via ICMP echo requests over IPv4.
+        Data is simply stored in the echo request's payload without any kind of
+        modification. Up to exfil_window chunks per target are in flight at
+        once, chunks which weren't echoed back within the timeout are sent
+        again up to exfil_retries times. Echoes are verified in any order.
 
-        Data is simply stored in the ICMP packet's payload without any kind of modification.
-
-        :param target: an IPv4 address
-        :param payload: the payload to exfiltrate
-        :return:
-        """
-        try:
-            for chunk in payload.chunk_iter():
-                random_id = self._random_icmp_id()
-                packet = IP(dst=target) / ICMP(id=random_id) / Raw(load=chunk)
-                answer = self._send_packet(packet)
-                if chunk not in bytes(answer.payload.payload):
-                    return False
-        except (TypeError, ValueError, AttributeError, KeyError):
-            return False
-        return True
-
-    def _exfil_ipv6(self, target, payload):
-        """
-        Exfiltrate the payload via ICMP echo requests over IPv6.
-
-        Data is simply stored in the ICMP packet's payload without any kind of modification.
-
-        :param target: an IPv6 address
+        :param engine: the ICMPEngine to send the requests with
+        :param targets: IPv4 and IPv6 addresses
         :param payload: the payload to exfiltrate
-        :return: bool, indicating success
+        :param chunk_sizes: optional dict of target -> chunk size, the data
+            of the payload's chunks is split into chunks of that size instead
+        :return: dict of target -> ExfilResult
         """
-        try:
-            for chunk in payload.chunk_iter():
-                random_id = self._random_icmp_id()
-                packet = IPv6(dst=target) / ICMPv6EchoRequest(id=random_id, data=chunk)
-                answer = self._send_packet(packet)
-                if chunk not in bytes(answer.payload.data):
-                    return False
-        except (TypeError, ValueError, AttributeError, KeyError):
-            return False
-        return True
-
-    def _ping(self, target):
-        """
-        Ping the target.
-
-        :param target:
-        :return: bool, indicating that the target sent an echo reply.
-        """
-        if is_ipv4_addr(target) is False and is_ipv6_addr(target) is False:
-            raise ValueError(
-                f"ICMPCheck.ping expected target to be an "
-                f"IPv4 or IPv6 address, got {target!r}"
-            )
-        if is_ipv4_addr(target) and self._with_ipv4:
-            return self._ping_ipv4(target)
-        if is_ipv6_addr(target) and self._with_ipv6:
-            return self._ping_ipv6(target)
-
-    def _exfil(self, target, payload):
-        """
-        Exfiltrate test data.
-
-        :param target: an IPv4 or IPv6 address
-        :param payload:
-        :return: bool, indicating success
-        """
-        if is_ipv4_addr(target) is False and is_ipv6_addr(target) is False:
-            raise ValueError(
-                f"ICMPCheck.exfil expected target to be an "
-                f"IPv4 or IPv6 address, got {target!r}"
-            )
-        if is_ipv4_addr(target) and self._with_ipv4:
-            return self._exfil_ipv4(target, payload)
-        if is_ipv6_addr(target) and self._with_ipv6:
-            return self._exfil_ipv6(target, payload)
-
-    def _to_message(self, target, status, payload=None):
-        if payload:
-            exfil_success = (
-                f"Exfiltrated {payload.chunks_total_length} bytes to {target}"
-            )
-            exfil_fail = f"Failed to exfiltrate data to {target}"
-        icmp_fail = f"No echo response from {target}"
-        icmp_success = f"Received echo response from {target}"
-
+        chunks = [chunk for chunk in payload.chunk_iter() if chunk]
+        data = b"".join(chunks)
+        requests = []
+        for target in targets:
+            size = (chunk_sizes or {}).get(target)
+            if size:
+                requests.extend(
+                    (target, data[i : i + size]) for i in range(0, len(data), size)
+                )
+            else:
+                requests.extend((target, chunk) for chunk in chunks)
+        started = time.monotonic()
+        echoes = engine.transfer(requests, self.exfil_window, self.exfil_retries)
+        results = {}
+        for target in targets:
+            results[target] = ExfilResult(0, len(data), 0.0)
+        for (target, chunk), echo in zip(requests, echoes):
+            if echo is None or chunk not in echo.payload:
+                continue
+            echoed, total, elapsed = results[target]
+            elapsed = max(elapsed, echo.received - started)
+            results[target] = ExfilResult(echoed + len(chunk), total, elapsed)
+        return results
+
+    def _enabled(self, target):
+        """Determine if the IP version of the target is enabled."""
+        if is_ipv4_addr(target):
+            return self._with_ipv4
+        return self._with_ipv6
+
+    def _to_message(self, target, status):
         if status is True:
-            msg = icmp_success
-            if payload is not None:
-                msg = exfil_success
+            return PositiveMessage(f"Received echo response from {target}")
+        return NegativeMessage(f"No echo response from {target}")
+
+    def _exfil_message(self, target, result):
+        if result.total and result.echoed == result.total:
+            msg = f"Exfiltrated {result.echoed} bytes to {target}"
+            if result.elapsed > 0:
+                msg += f" at {result.echoed / result.elapsed:.0f} bytes/s"
             return PositiveMessage(msg)
-
-        msg = icmp_fail
-        if payload is not None:
-            msg = exfil_fail
-        return NegativeMessage(msg)
+        return NegativeMessage(
+            f"Failed to exfiltrate data to {target}, "
+            f"{result.echoed} of {result.total} bytes echoed"
+        )
 
     def check(self):
+        self.stats = rtt.LossStats()
+        targets = []
+        skipped = []
         for target in self.target_hosts:
             if is_ipv4_addr(target) is False and is_ipv6_addr(target) is False:
-                yield InfoMessage(f"Skipped target {target!r} because it's not an IP")
-                continue
-            if is_ipv4_addr(target) and not self._with_ipv4:
-                continue
-            if is_ipv6_addr(target) and not self._with_ipv6:
-                continue
-            status = self._ping(target)
-            yield self._to_message(target, status)
+                skipped.append(target)
+            elif self._enabled(target):
+                targets.append(target)
+        for target in skipped:
+            yield InfoMessage(f"Skipped target {target!r} because it's not an IP")
 
+        try:
+            with self._engine() as engine:
+                pinged = self._ping_all(engine, targets)
+                reachable = [target for target in targets if pinged[target]]
+                echo_stats = {}
+                if self.burst:
+                    for target, rtts in engine.burst(targets, self.burst).items():
+                        echo_stats[target] = rtt.BurstStats.from_samples(rtts)
+                payload_sizes = {}
+                if self.discover_payload_size:
+                    payload_sizes = engine.discover_payload_size(
+                        reachable, self.max_payload_size
+                    )
+                exfiltrated = {}
+                if self.exfil_payload:
+                    exfiltrated = self._exfil_all(
+                        engine, targets, self.exfil_payload, payload_sizes
+                    )
+        except PermissionError:
+            yield NegativeMessage(
+                f"Not permitted to send ICMP echo requests with the "
+                f"{self.backend!r} backend, run as root or allow ping sockets "
+                f"through net.ipv4.ping_group_range"
+            )
+            return
+
+        self.results = {
+            target: ICMPResult(
+                reachable=pinged[target],
+                payload_size=payload_sizes.get(target),
+                echo_stats=echo_stats.get(target),
+                exfil=exfiltrated.get(target),
+            )
+            for target in targets
+        }
+        for target in targets:
+            result = self.results[target]
+            yield self._to_message(target, result.reachable)
+            if result.echo_stats is not None:
+                yield InfoMessage(f"Echo statistics of {target}: {result.echo_stats}")
+            if result.payload_size is not None:
+                yield InfoMessage(
+                    f"Largest echo payload returned by {target}: "
+                    f"{result.payload_size} bytes"
+                )
             if self.exfil_payload:
-                status = self._exfil(target, self.exfil_payload)
-                yield self._to_message(target, status, self.exfil_payload)
+                yield self._exfil_message(target, result.exfil)
+
+        if self.hedges and self.stats.total:
+            yield InfoMessage(f"ICMP probes: {self.stats}")
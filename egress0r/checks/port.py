@@ -1,19 +1,41 @@
+import collections
+import errno
+import functools
 import io
-import os
 import socket
+import time
 import uuid
-from multiprocessing import Pool
 
 from scapy.all import IP, UDP, IPv6, Raw
 
 import pycurl
-from egress0r.constants import data_dir
-from egress0r.message import NegativeMessage, PositiveMessage
+from egress0r import executor as executor_
+from egress0r import ratelimit, rtt
+from egress0r.checkpoint import Checkpoint
+from egress0r.engines import AsyncTCPEngine, SYNEngine, UDPMuxEngine
+from egress0r.message import InfoMessage, NegativeMessage, PositiveMessage
+from egress0r.ports import PortPermutation, PortSet, read_port_file, top_ports
+from egress0r.portstate import PortState, PortStateMatrix, collapse_ranges
+from egress0r.sampling import (
+    DEFAULT_ALLOW,
+    DEFAULT_DENY,
+    DEFAULT_DENY_WITH_EXCEPTIONS,
+    MIXED,
+    PortSampler,
+)
+from egress0r.scheduler import SweepScheduler
+from egress0r.targets import TargetPool
 from egress0r.utils import ip_to_url
 
 
 class PortCheck:
-    """Check for unfiltered egress ports."""
+    """Check for unfiltered egress ports.
+
+    ipv4_addr and ipv6_addr are either a single reflector or a list of
+    equivalent ones, in which case the ports are sharded across them. Ports
+    which didn't answer on a reflector that stopped answering altogether are
+    probed again on the remaining ones, every port is reported once.
+    """
 
     PORT_MIN = 1
     PORT_MAX = 65535
@@ -21,8 +43,26 @@ class PortCheck:
     DEFAULT_TCP_TIMEOUT = 6
     DEFAULT_WITH_UDP = True
     DEFAULT_WITH_TCP = True
-    VALID_MODES = ("top10", "top100", "all")
+    VALID_MODES = ("top10", "top100", "all", "sample")
     DEFAULT_MODE = "top10"
+    VALID_ENGINES = ("pool", "async")
+    DEFAULT_ENGINE = "pool"
+    DEFAULT_CONCURRENCY = AsyncTCPEngine.DEFAULT_CONCURRENCY
+    VALID_TCP_METHODS = ("connect", "syn")
+    DEFAULT_TCP_METHOD = "connect"
+    DEFAULT_SYN_RATE = SYNEngine.DEFAULT_RATE
+    VALID_UDP_METHODS = ("socket", "mux")
+    DEFAULT_UDP_METHOD = "socket"
+    VALID_REPORTS = ("auto", "ports", "ranges")
+    DEFAULT_REPORT = "auto"
+    VALID_ORDERS = ("sequential", "random")
+    DEFAULT_ORDER = "sequential"
+    DEFAULT_CHECKPOINT_INTERVAL = Checkpoint.DEFAULT_INTERVAL
+    DEFAULT_SAMPLE_SIZE = PortSampler.DEFAULT_SAMPLE_SIZE
+    DEFAULT_SAMPLE_CONFIDENCE = PortSampler.DEFAULT_CONFIDENCE
+    SAMPLE_PINNED_PORTS = 100
+    DEFAULT_UDP_HEDGES = 0
+    RANGE_REPORT_THRESHOLD = 100
     START_MESSAGE = "Performing egress port checks..."
 
     def __init__(
@@ -36,9 +76,54 @@ class PortCheck:
         with_tcp=DEFAULT_WITH_TCP,
         with_ipv4=True,
         with_ipv6=True,
+        engine=DEFAULT_ENGINE,
+        concurrency=DEFAULT_CONCURRENCY,
+        executor=None,
+        tcp_method=DEFAULT_TCP_METHOD,
+        syn_rate=DEFAULT_SYN_RATE,
+        udp_method=DEFAULT_UDP_METHOD,
+        report=DEFAULT_REPORT,
+        port_spec=None,
+        order=DEFAULT_ORDER,
+        seed=None,
+        checkpoint_file=None,
+        checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+        resume=False,
+        sample_size=DEFAULT_SAMPLE_SIZE,
+        sample_confidence=DEFAULT_SAMPLE_CONFIDENCE,
+        udp_hedges=DEFAULT_UDP_HEDGES,
+        udp_hedge_delay=None,
     ):
-        self.ipv4_addr = ipv4_addr
-        self.ipv6_addr = ipv6_addr
+        if engine not in self.VALID_ENGINES:
+            raise ValueError(
+                f"PortCheck expects argument engine to be one of "
+                f"{self.VALID_ENGINES}, got {engine!r}"
+            )
+        if tcp_method not in self.VALID_TCP_METHODS:
+            raise ValueError(
+                f"PortCheck expects argument tcp_method to be one of "
+                f"{self.VALID_TCP_METHODS}, got {tcp_method!r}"
+            )
+        if udp_method not in self.VALID_UDP_METHODS:
+            raise ValueError(
+                f"PortCheck expects argument udp_method to be one of "
+                f"{self.VALID_UDP_METHODS}, got {udp_method!r}"
+            )
+        if report not in self.VALID_REPORTS:
+            raise ValueError(
+                f"PortCheck expects argument report to be one of "
+                f"{self.VALID_REPORTS}, got {report!r}"
+            )
+        if order not in self.VALID_ORDERS:
+            raise ValueError(
+                f"PortCheck expects argument order to be one of "
+                f"{self.VALID_ORDERS}, got {order!r}"
+            )
+        self.ipv4_addrs = self._as_addrs(ipv4_addr)
+        self.ipv6_addrs = self._as_addrs(ipv6_addr)
+        self.ipv4_addr = self.ipv4_addrs[0] if self.ipv4_addrs else None
+        self.ipv6_addr = self.ipv6_addrs[0] if self.ipv6_addrs else None
+        self._targets = self._target_pools()
         self._mode = mode
         self.udp_timeout = udp_timeout
         self.tcp_timeout = tcp_timeout
@@ -46,8 +131,41 @@ class PortCheck:
         self.with_tcp = with_tcp
         self._with_ipv4 = with_ipv4
         self._with_ipv6 = with_ipv6
+        self.engine = engine
+        self.concurrency = concurrency
+        self._executor = executor
+        self.tcp_method = tcp_method
+        self.syn_rate = syn_rate
+        self.udp_method = udp_method
+        self.report = report
+        self.port_spec = port_spec
+        if port_spec:
+            # Fail early on invalid specs instead of once the check runs.
+            PortSet.from_spec(port_spec)
+        self.order = order
+        self.seed = seed
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.resume = resume
+        self.sample_size = sample_size
+        self.sample_confidence = sample_confidence
+        self.udp_hedges = udp_hedges
+        self.udp_hedge_delay = udp_hedge_delay
+        self.udp_stats = rtt.LossStats()
+        self.results = PortStateMatrix()
         self._identifier = str(uuid.uuid4())
 
+    @staticmethod
+    def _as_addrs(addrs):
+        if not addrs:
+            return []
+        if isinstance(addrs, str):
+            return [addrs]
+        return list(addrs)
+
+    def _target_pools(self):
+        return {4: TargetPool(self.ipv4_addrs), 6: TargetPool(self.ipv6_addrs)}
+
     @property
     def mode(self):
         return self._mode
@@ -61,6 +179,20 @@ class PortCheck:
             )
         self._mode = m
 
+    def __getstate__(self):
+        # Worker processes only probe single ports, don't ship them the results.
+        state = self.__dict__.copy()
+        state["results"] = PortStateMatrix()
+        state["udp_stats"] = rtt.LossStats()
+        state["_targets"] = None
+        return state
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            return executor_.get()
+        return self._executor
+
     def _setup_curl(self, url, timeout=None):
         if timeout is None:
             timeout = self.tcp_timeout
@@ -69,139 +201,650 @@ class PortCheck:
         curl.setopt(pycurl.URL, url)
         curl.setopt(pycurl.WRITEDATA, buf)
         curl.setopt(pycurl.USERAGENT, "curl/7.59.0")
-        curl.setopt(pycurl.TIMEOUT, timeout)
+        curl.setopt(pycurl.TIMEOUT_MS, max(1, int(timeout * 1000)))
         return curl, buf
 
-    def _connect_ipv4_tcp(self, port):
-        url = ip_to_url(self.ipv4_addr, port=port)
+    def _connect_tcp(self, addr, port, timeout=None):
+        """Connect to the port and check the reflector's answer.
+
+        Returns the PortState and, if the port is open, the seconds the
+        exchange took.
+        """
+        url = ip_to_url(addr, port=port)
+        curl, buf = self._setup_curl(url, timeout)
+        started = time.monotonic()
         try:
-            curl, buf = self._setup_curl(url)
             curl.perform()
         except (pycurl.error, socket.timeout):
-            return port, False
+            refused = curl.getinfo(pycurl.OS_ERRNO) == errno.ECONNREFUSED
+            curl.close()
+            return (PortState.CLOSED if refused else PortState.FILTERED), None
+        elapsed = time.monotonic() - started
 
         keyword = f"Port: {port} reached."
         response = buf.getvalue().decode("utf8", errors="replace")
         buf.close()
         curl.close()
-        return port, keyword in response
+        if keyword in response:
+            return PortState.OPEN, elapsed
+        return PortState.FILTERED, None
+
+    def _connect_udp(self, family, addr, port, payload, timeout=None, delay=None):
+        """Send the payload from a connected socket, the kernel then reports ICMP
+        errors for it, which lets closed ports fail without waiting for the timeout.
 
-    def _connect_ipv4_udp(self, port):
-        pkt = IP(dst=self.ipv4_addr) / UDP(dport=port) / Raw(load=self._identifier)
-        response = b""
+        Up to udp_hedges duplicates are sent every delay seconds while no
+        answer arrived, the first answer to any of them counts. Returns the
+        PortState, how many datagrams were sent and, if the first one was
+        answered, its round trip time.
+        """
+        if timeout is None:
+            timeout = self.udp_timeout
+        if delay is None:
+            delay = self.udp_hedge_delay or timeout / (self.udp_hedges + 1)
+        started = time.monotonic()
+        deadline = started + timeout
+        attempts = 0
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                sock.settimeout(self.udp_timeout)
-                sock.sendto(bytes(pkt), (self.ipv4_addr, port))
-                response = sock.recvfrom(1024)
+            with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                sock.connect((addr, port))
+                while True:
+                    sock.send(payload)
+                    attempts += 1
+                    wait_until = deadline
+                    if attempts <= self.udp_hedges:
+                        wait_until = min(deadline, time.monotonic() + delay)
+                    sock.settimeout(max(0.001, wait_until - time.monotonic()))
+                    try:
+                        response = sock.recv(1024)
+                        break
+                    except socket.timeout:
+                        if wait_until >= deadline:
+                            return PortState.FILTERED, attempts, None
+        except ConnectionRefusedError:
+            return PortState.CLOSED, attempts, None
         except (socket.timeout, TypeError, OSError):
-            pass
-        return port, self._identifier in str(response)
+            return PortState.FILTERED, attempts, None
+        if self._identifier.encode("ascii") in response:
+            elapsed = time.monotonic() - started if attempts == 1 else None
+            return PortState.OPEN, attempts, elapsed
+        return PortState.FILTERED, attempts, None
 
-    def _connect_ipv6_tcp(self, port):
-        url = ip_to_url(self.ipv6_addr, port=port)
-        try:
-            curl, buf = self._setup_curl(url)
-            curl.perform()
-        except (pycurl.error, socket.timeout):
-            return port, False
+    def _connect_ipv4_tcp(self, port, addr=None, timeout=None):
+        return (port,) + self._connect_tcp(addr or self.ipv4_addr, port, timeout)
 
-        keyword = f"Port: {port} reached."
-        response = buf.getvalue().decode("utf8", errors="replace")
-        buf.close()
-        curl.close()
-        return port, keyword in response
+    def _connect_ipv4_udp(self, port, addr=None, timeout=None, delay=None):
+        addr = addr or self.ipv4_addr
+        pkt = IP(dst=addr) / UDP(dport=port) / Raw(load=self._identifier)
+        return (port,) + self._connect_udp(
+            socket.AF_INET, addr, port, bytes(pkt), timeout, delay
+        )
 
-    def _connect_ipv6_udp(self, port):
-        pkt = IPv6(dst=self.ipv6_addr) / UDP(dport=port) / Raw(load=self._identifier)
-        response = b""
-        try:
-            with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
-                sock.settimeout(self.udp_timeout)
-                sock.sendto(bytes(pkt), (self.ipv6_addr, port))
-                response = sock.recvfrom(1024)
-        except (socket.timeout, TypeError, OSError):
-            pass
-        return port, self._identifier in str(response)
+    def _connect_ipv6_tcp(self, port, addr=None, timeout=None):
+        return (port,) + self._connect_tcp(addr or self.ipv6_addr, port, timeout)
+
+    def _connect_ipv6_udp(self, port, addr=None, timeout=None, delay=None):
+        addr = addr or self.ipv6_addr
+        pkt = IPv6(dst=addr) / UDP(dport=port) / Raw(load=self._identifier)
+        return (port,) + self._connect_udp(
+            socket.AF_INET6, addr, port, bytes(pkt), timeout, delay
+        )
 
     def _all_ports(self):
-        return tuple(range(self.PORT_MIN, self.PORT_MAX + 1))
+        return PortSet([(self.PORT_MIN, self.PORT_MAX + 1)])
 
     def _top_100_ports(self):
-        ports = []
-        with open(os.path.join(data_dir, "top-100-ports.txt")) as fin:
-            for line in fin.readlines():
-                try:
-                    port = int(line.strip())
-                    if self.PORT_MIN - 1 < port < self.PORT_MAX + 1:
-                        ports.append(port)
-                except (ValueError, TypeError):
-                    pass
-
-        return tuple(ports)
+        return read_port_file("top-100-ports.txt")
 
     def _top_10_ports(self):
-        ports = []
-        with open(os.path.join(data_dir, "top-10-ports.txt")) as fin:
-            for line in fin.readlines():
-                try:
-                    port = int(line.strip())
-                    if self.PORT_MIN - 1 < port < self.PORT_MAX + 1:
-                        ports.append(port)
-                except (ValueError, TypeError):
-                    pass
-
-        return tuple(ports)
-
-    def _check_tcp_ports(self, port_iter, ip_version=4):
-        pool = Pool()
-        check_func = self._connect_ipv4_tcp
-        if ip_version == 6:
-            check_func = self._connect_ipv6_tcp
-        for port, status in pool.imap(check_func, iterable=port_iter):
+        return read_port_file("top-10-ports.txt")
+
+    def _ports(self):
+        """Determine which ports to check, a port spec takes precedence over the mode."""
+        if self.port_spec:
+            return PortSet.from_spec(self.port_spec)
+        if self.mode in ("all", "sample"):
+            return self._all_ports()
+        if self.mode == "top100":
+            return self._top_100_ports()
+        if self.mode == "top10":
+            return self._top_10_ports()
+        raise ValueError(
+            f"PortCheck.mode must be in {self.VALID_MODES}, got {self.mode!r}"
+        )
+
+    def _ordered_ports(self):
+        """Determine the ports to check in the order they should be probed in."""
+        ports = self._ports()
+        if self.order == "random":
+            return PortPermutation(ports, self.seed)
+        return ports
+
+    def _checkpoint(self, ports):
+        """Build the Checkpoint of a sweep over ports, None if checkpointing is off."""
+        if not self.checkpoint_file:
+            return None
+        if isinstance(ports, PortPermutation):
+            ports = ports.ports
+        identity = {
+            "ipv4_addr": self.ipv4_addrs,
+            "ipv6_addr": self.ipv6_addrs,
+            "ports": [list(r) for r in PortSet(ports).ranges],
+        }
+        return Checkpoint(self.checkpoint_file, identity, self.checkpoint_interval)
+
+    def _addr(self, ip_version):
+        return self.ipv4_addr if ip_version == 4 else self.ipv6_addr
+
+    def _host(self, ip_version):
+        """Describe the reflectors of an IP version for messages."""
+        addrs = self.ipv4_addrs if ip_version == 4 else self.ipv6_addrs
+        return ", ".join(addrs)
+
+    def _check_tcp_ports(self, port_iter, ip_version=4, share=1.0, addr=None):
+        if self.tcp_method == "syn":
+            return self._syn_scan_tcp_ports(
+                port_iter, ip_version=ip_version, share=share, addr=addr
+            )
+        return self._connect_tcp_ports(
+            port_iter, ip_version=ip_version, share=share, addr=addr
+        )
+
+    def _syn_scan_tcp_ports(self, port_iter, ip_version=4, share=1.0, addr=None):
+        """SYN scan the ports, only ports answering with a SYN-ACK are connected to.
+        Falls back to a regular connect scan if raw sockets aren't permitted.
+        """
+        addr = addr or self._addr(ip_version)
+        rate = max(1, int(self.syn_rate * share))
+        engine = SYNEngine(
+            addr,
+            self.tcp_timeout,
+            rate,
+            rtt=rtt.get("syn", addr),
+            limiter=ratelimit.get(),
+        )
+        verify = functools.partial(
+            self._connect_tcp_ports, ip_version=ip_version, share=share, addr=addr
+        )
+        port_iter = tuple(port_iter)
+        try:
+            yield from engine.sweep(port_iter, verify)
+        except PermissionError:
+            limiter = ratelimit.get()
+            for port, status in verify(port_iter):
+                limiter.report(status is PortState.FILTERED)
+                yield port, status
+
+    def _connect_tcp_ports(self, port_iter, ip_version=4, share=1.0, addr=None):
+        addr = addr or self._addr(ip_version)
+        if self.engine == "async":
+            concurrency = max(1, int(self.concurrency * share))
+            engine = AsyncTCPEngine(
+                addr,
+                self.tcp_timeout,
+                concurrency,
+                rtt=rtt.get("tcp", addr),
+                limiter=ratelimit.get(),
+            )
+            yield from engine.sweep(port_iter)
+            return
+
+        tasks = (("tcp", ip_version, port, addr) for port in port_iter)
+        for _, _, port, status, _ in self._executor_probes(tasks):
             yield port, status
 
-    def _check_udp_ports(self, port_iter, ip_version=4):
-        pool = Pool()
-        check_func = self._connect_ipv4_udp
-        if ip_version == 6:
-            check_func = self._connect_ipv6_udp
-        for port, status in pool.imap(check_func, iterable=port_iter):
+    def _check_udp_ports(self, port_iter, ip_version=4, share=1.0, addr=None):
+        addr = addr or self._addr(ip_version)
+        if self.udp_method == "mux":
+            engine = UDPMuxEngine(
+                addr,
+                self.udp_timeout,
+                self._identifier,
+                rtt=rtt.get("udp", addr),
+                limiter=ratelimit.get(),
+                hedges=self.udp_hedges,
+                hedge_delay=self.udp_hedge_delay,
+                stats=self.udp_stats,
+            )
+            yield from engine.sweep(port_iter)
+            return
+
+        tasks = (("udp", ip_version, port, addr) for port in port_iter)
+        for _, _, port, status, _ in self._executor_probes(tasks):
             yield port, status
 
+    def _runs_in_process(self, protocol):
+        """Determine if sweeps of the protocol are performed by an in-process engine
+        instead of the shared executor.
+        """
+        if protocol == "tcp":
+            return self.engine == "async" or self.tcp_method == "syn"
+        return self.udp_method == "mux"
+
+    def _uses_executor(self):
+        """Determine if any sweep probes, or verifies, ports with the executor."""
+        return (self.with_tcp and self.engine == "pool") or (
+            self.with_udp and self.udp_method != "mux"
+        )
+
+    def _reports_loss(self, protocol):
+        """Determine if the engine sweeping the protocol reports the outcome of
+        its probes to the rate limiter itself, while it is still sending.
+        """
+        if protocol == "tcp":
+            return self.tcp_method == "syn"
+        return self.udp_method == "mux"
+
+    def _probe_task(self, protocol, ip_version, port, addr):
+        """Build the executor task probing port on addr.
+
+        The worker processes don't share the round trip time estimators, so
+        the timeout, and the hedge delay of UDP probes, are derived here.
+        """
+        estimator = rtt.get(protocol, addr)
+        if protocol == "tcp":
+            return protocol, ip_version, port, addr, estimator.timeout(self.tcp_timeout)
+        timeout = estimator.timeout(self.udp_timeout)
+        delay = self.udp_hedge_delay or estimator.hedge_delay(timeout, self.udp_hedges)
+        return protocol, ip_version, port, addr, timeout, delay
+
+    def _probe_port(self, task):
+        """Probe a single task built by _probe_task in a worker process.
+        Returns (protocol, ip_version, port, status, attempts, addr, rtt), rtt
+        being None unless the first probe was answered.
+        """
+        protocol, ip_version, port, addr, *timeouts = task
+        probes = {
+            ("tcp", 4): self._connect_ipv4_tcp,
+            ("tcp", 6): self._connect_ipv6_tcp,
+            ("udp", 4): self._connect_ipv4_udp,
+            ("udp", 6): self._connect_ipv6_udp,
+        }
+        port, status, *result = probes[(protocol, ip_version)](port, addr, *timeouts)
+        attempts, sample = result if protocol == "udp" else (1, *result)
+        return protocol, ip_version, port, status, attempts, addr, sample
+
+    def _executor_probes(self, tasks):
+        """Probe (protocol, ip_version, port, addr) tasks on the executor.
+
+        The round trip times measured by the workers are fed to the estimators
+        of this process. Yields (protocol, ip_version, port, status, addr).
+        """
+        tasks = (self._probe_task(*task) for task in tasks)
+        for result in self.executor.imap(self._probe_port, ratelimit.paced(tasks)):
+            protocol, ip_version, port, status, attempts, addr, sample = result
+            if sample is not None:
+                rtt.get(protocol, addr).add_sample(sample)
+            if protocol == "udp":
+                self.udp_stats.record(status is not PortState.FILTERED, attempts)
+            yield protocol, ip_version, port, status, addr
+
+    def _spread(self, results, reprobe):
+        """Merge the results of sweeps spread across several reflectors.
+
+        results yields (sweep, port, status, addr) tuples, the outcome of every
+        probe is fed to the health tracking of the reflector it was sent to,
+        closed ports answered as well. With more than one reflector, filtered
+        ports are held back until their reflector answers a later probe, the
+        results of a sweep are still passed on in the order they arrived. The
+        held ports of a reflector which went down meanwhile are passed to
+        reprobe as (sweep, port) tuples once the sweeps are done, which probes
+        them on the remaining reflectors. Yields every port once as
+        (sweep, port, status).
+        """
+        queues = collections.defaultdict(collections.deque)
+        answered_at = {}
+        retry = []
+        for index, (sweep, port, status, addr) in enumerate(results):
+            pool = self._targets[sweep[1]]
+            answered = status is not PortState.FILTERED
+            pool.record(addr, answered)
+            if answered:
+                answered_at[addr] = index
+            if len(pool) == 1:
+                yield sweep, port, status
+                continue
+            queue = queues[sweep]
+            queue.append((index, port, status, addr))
+            while queue:
+                held, held_port, held_status, held_addr = queue[0]
+                unconfirmed = answered_at.get(held_addr, -1) < held
+                if held_status is PortState.FILTERED and unconfirmed:
+                    if not (pool.is_down(held_addr) and pool.healthy):
+                        break
+                    retry.append((sweep, held_port))
+                else:
+                    yield sweep, held_port, held_status
+                queue.popleft()
+
+        for sweep, queue in queues.items():
+            pool = self._targets[sweep[1]]
+            for held, port, status, addr in queue:
+                if status is PortState.FILTERED and pool.is_down(addr) and pool.healthy:
+                    retry.append((sweep, port))
+                else:
+                    yield sweep, port, status
+        if retry:
+            for sweep, port, status, addr in reprobe(retry):
+                self._targets[sweep[1]].record(addr, status is not PortState.FILTERED)
+                yield sweep, port, status
+
+    def _pooled_probes(self, tasks):
+        """Probe (protocol, ip_version, port) tasks on the executor, the reflector
+        of each task is picked when it's dispatched.
+        """
+        tasks = (
+            (protocol, ip_version, port, self._targets[ip_version].pick(port))
+            for protocol, ip_version, port in tasks
+        )
+        for protocol, ip_version, port, status, addr in self._executor_probes(tasks):
+            yield (protocol, ip_version), port, status, addr
+
+    def _pooled_sweeps(self, sweeps, port_iter, done):
+        """Perform several sweeps as one interleaved task stream on the executor."""
+        tasks = (
+            (protocol, ip_version, port)
+            for port in port_iter
+            for protocol, ip_version in sweeps
+            if (ip_version, protocol, port) not in done
+        )
+        yield from self._spread(self._pooled_probes(tasks), self._pooled_reprobe)
+
+    def _pooled_reprobe(self, items):
+        tasks = ((protocol, v, port) for (protocol, v), port in items)
+        return self._pooled_probes(tasks)
+
+    def _pending_ports(self, sweep, port_iter, done):
+        """Skip the ports of port_iter which already have a result in done."""
+        protocol, ip_version = sweep
+        for port in port_iter:
+            if (ip_version, protocol, port) not in done:
+                yield port
+
+    def _recorded(self, source, checkpoint, report=True):
+        """Record the results of source in self.results as soon as they arrive.
+        Unless report is False, e.g. for engines reporting their probes
+        themselves, unanswered probes are reported to the rate limiter as lost.
+        """
+        limiter = ratelimit.get()
+        for sweep, port, status in source():
+            protocol, ip_version = sweep
+            self.results[ip_version, protocol, port] = status
+            if report:
+                limiter.report(status is PortState.FILTERED)
+            if checkpoint is not None:
+                checkpoint.update(self.results)
+            yield sweep, port, status
+
+    def _in_process_probes(self, sweep, port_iter, share):
+        """Run an in-process engine per healthy reflector, each on its shard of
+        the ports. Yields (sweep, port, status, addr).
+        """
+        protocol, ip_version = sweep
+        check_func = self._check_tcp_ports
+        if protocol == "udp":
+            check_func = self._check_udp_ports
+        healthy = self._targets[ip_version].healthy
+        if len(healthy) == 1:
+            addr = healthy[0]
+            for port, status in check_func(
+                port_iter, ip_version=ip_version, share=share, addr=addr
+            ):
+                yield sweep, port, status, addr
+            return
+
+        shards = self._targets[ip_version].shard(port_iter)
+        scheduler = SweepScheduler(list(shards))
+        for addr, ports in shards.items():
+            source = functools.partial(
+                check_func,
+                ports,
+                ip_version=ip_version,
+                share=share / len(shards),
+                addr=addr,
+            )
+            scheduler.add([addr], functools.partial(self._keyed, addr, source))
+        for addr, port, status in scheduler.run(ordered=False):
+            yield sweep, port, status, addr
+
+    @staticmethod
+    def _keyed(key, source):
+        for port, status in source():
+            yield key, port, status
+
+    def _in_process_reprobe(self, sweep, share, items):
+        return self._in_process_probes(sweep, [port for _, port in items], share)
+
+    def _in_process_sweep(self, sweep, port_iter, share):
+        reprobe = functools.partial(self._in_process_reprobe, sweep, share)
+        yield from self._spread(
+            self._in_process_probes(sweep, port_iter, share), reprobe
+        )
+
+    def _sweeps(self):
+        """List the (protocol, ip_version) sweeps to perform, in reporting order."""
+        ip_versions = []
+        if self._with_ipv4 and self.ipv4_addrs:
+            ip_versions.append(4)
+        if self._with_ipv6 and self.ipv6_addrs:
+            ip_versions.append(6)
+        protocols = []
+        if self.with_tcp:
+            protocols.append("tcp")
+        if self.with_udp:
+            protocols.append("udp")
+        return [(protocol, v) for protocol in protocols for v in ip_versions]
+
+    def _schedule(
+        self, port_iter, ordered=True, done=None, checkpoint=None, sweeps=None
+    ):
+        """Run all sweeps concurrently, yields ((protocol, ip_version), port, status).
+
+        Sweeps handled by the executor share its workers through a single
+        interleaved task stream, the in-process engines split the configured
+        concurrency and SYN rate evenly among themselves. Unless ordered is
+        False, results are yielded sweep by sweep in probing order, only ports
+        probed again on another reflector come last.
+
+        Only the given sweeps are run, all of them by default. Ports with a
+        result in done are skipped, all results are recorded in
+        self.results and saved to the checkpoint as they arrive.
+        """
+        done = done or PortStateMatrix()
+        sweeps = sweeps or self._sweeps()
+        scheduler = SweepScheduler(sweeps)
+        pooled = [s for s in sweeps if not self._runs_in_process(s[0])]
+        in_process = [s for s in sweeps if self._runs_in_process(s[0])]
+        if pooled:
+            source = functools.partial(self._pooled_sweeps, pooled, port_iter, done)
+            scheduler.add(pooled, functools.partial(self._recorded, source, checkpoint))
+        for sweep in in_process:
+            share = 1.0 / len(in_process)
+            pending = self._pending_ports(sweep, port_iter, done)
+            source = functools.partial(self._in_process_sweep, sweep, pending, share)
+            report = not self._reports_loss(sweep[0])
+            scheduler.add(
+                [sweep], functools.partial(self._recorded, source, checkpoint, report)
+            )
+        return scheduler.run(ordered=ordered)
+
     @staticmethod
     def _message_producer(port, protocol, status, host):
         success_msg = f"Connected via {port}/{protocol} to {host}"
         fail_msg = f"Failed to connect via {port}/{protocol} to {host}"
         if status:
             return PositiveMessage(success_msg)
+        if isinstance(status, PortState):
+            fail_msg += f" ({status.name.lower()})"
         return NegativeMessage(fail_msg)
 
+    def _range_messages(self, sweeps):
+        """Summarize the results of each sweep, collapsing ports into ranges."""
+        for protocol, ip_version in sweeps:
+            prefix = f"{protocol}/v{ip_version} to {self._host(ip_version)}"
+            for state in PortState:
+                count = self.results.count(ip_version, protocol, state)
+                if not count:
+                    continue
+                ranges = collapse_ranges(
+                    self.results.ports(ip_version, protocol, state)
+                )
+                if state is PortState.OPEN:
+                    yield PositiveMessage(
+                        f"{prefix} allowed on {count} ports: {ranges}"
+                    )
+                else:
+                    yield NegativeMessage(
+                        f"{prefix} {state.name.lower()} on {count} ports: {ranges}"
+                    )
+
+    def _resumed_messages(self, done):
+        """Report the results taken over from a checkpoint, sweep by sweep."""
+        for protocol, ip_version in self._sweeps():
+            resumed = sorted(
+                (port, state)
+                for state in PortState
+                for port in done.ports(ip_version, protocol, state)
+            )
+            for port, state in resumed:
+                yield self._message_producer(
+                    port, protocol, state, self._host(ip_version)
+                )
+
+    def _sample_check(self):
+        """Classify the policy of every sweep from a stratified sample of all ports.
+
+        Strata whose sample is inconclusive are probed exhaustively afterwards,
+        sweeps sharing the same inconclusive strata are escalated together.
+        """
+        sampler = PortSampler(
+            self._all_ports(),
+            pinned=top_ports(self.SAMPLE_PINNED_PORTS),
+            sample_size=self.sample_size,
+            confidence=self.sample_confidence,
+            seed=self.seed,
+        )
+        self.results = PortStateMatrix()
+        for _ in self._schedule(sampler.ports, ordered=False):
+            pass
+
+        escalations = {}
+        for protocol, ip_version in self._sweeps():
+            strata = sampler.inconclusive(self.results, ip_version, protocol)
+            ranges = tuple(r for stratum in strata for r in stratum.ports.ranges)
+            if ranges:
+                escalations.setdefault(ranges, []).append((protocol, ip_version))
+        for ranges, sweeps in escalations.items():
+            ports = PortSet(ranges)
+            for _ in self._schedule(ports, False, done=self.results, sweeps=sweeps):
+                pass
+
+        confidence = round(self.sample_confidence * 100)
+        for protocol, ip_version in self._sweeps():
+            policy = sampler.classify(self.results, ip_version, protocol)
+            summary = (
+                f"{protocol}/v{ip_version} to {self._host(ip_version)} is "
+                f"{policy.name}: {policy.open} of {policy.sampled} sampled ports "
+                f"allowed ({confidence}% CI {policy.low:.1%} - {policy.high:.1%})"
+            )
+            if policy.escalated:
+                summary += (
+                    f", {policy.escalated} of {len(sampler.strata)} port blocks "
+                    f"probed exhaustively"
+                )
+            if policy.name == DEFAULT_DENY:
+                yield NegativeMessage(summary)
+            elif policy.name == DEFAULT_DENY_WITH_EXCEPTIONS:
+                exceptions = collapse_ranges(policy.exceptions)
+                yield PositiveMessage(f"{summary}, allowed exceptions: {exceptions}")
+            elif policy.name == DEFAULT_ALLOW and policy.exceptions:
+                exceptions = collapse_ranges(policy.exceptions)
+                yield PositiveMessage(f"{summary}, blocked exceptions: {exceptions}")
+            elif policy.name == MIXED:
+                allowed = collapse_ranges(policy.allowed)
+                yield PositiveMessage(f"{summary}, allowed in: {allowed}")
+            else:
+                yield PositiveMessage(summary)
+
+    def _target_messages(self):
+        """Report the reflectors which stopped answering during the check."""
+        for pool in self._targets.values():
+            for addr in pool.down:
+                yield NegativeMessage(
+                    f"Reflector {addr} stopped answering, its unanswered ports "
+                    f"were probed again on the remaining reflectors"
+                )
+
+    def _loss_messages(self):
+        """Report how well hedging worked for the UDP probes."""
+        if self.udp_hedges and self.udp_stats.total:
+            yield InfoMessage(f"UDP probes: {self.udp_stats}")
+
+    def _rate_messages(self, meter):
+        """Report the rate the probes of the check were sent at."""
+        limiter = ratelimit.get()
+        if not limiter.enabled or meter.rate is None:
+            return
+        yield InfoMessage(
+            f"Sent {meter.sent} probes at {meter.rate:.0f}/s on average, "
+            f"rate limit at {limiter.rate:.0f}/s (configured {limiter.max_rate:.0f}/s)"
+        )
+
     def check(self):
         """Check for port filtering."""
-        if self.mode == "all":
-            ports = self._all_ports()
-        elif self.mode == "top100":
-            ports = self._top_100_ports()
-        elif self.mode == "top10":
-            ports = self._top_10_ports()
+        meter = ratelimit.get().meter()
+        self.udp_stats = rtt.LossStats()
+        self._targets = self._target_pools()
+        if self._uses_executor():
+            # Fork the workers before the sweeps start their threads.
+            self.executor.start()
+        if self.mode == "sample" and not self.port_spec:
+            yield from self._sample_check()
         else:
-            raise ValueError(
-                f"PortCheck.mode must be in {self.VALID_MODES}, got {self.mode!r}"
-            )
+            yield from self._sweep_check()
+        yield from self._target_messages()
+        yield from self._loss_messages()
+        yield from self._rate_messages(meter)
 
-        if self.with_tcp:
-            if self._with_ipv4 and self.ipv4_addr:
-                for port, status in self._check_tcp_ports(ports, ip_version=4):
-                    yield self._message_producer(port, "tcp", status, self.ipv4_addr)
-            if self._with_ipv6 and self.ipv6_addr:
-                for port, status in self._check_tcp_ports(ports, ip_version=6):
-                    yield self._message_producer(port, "tcp", status, self.ipv6_addr)
+    def _sweep_check(self):
+        """Check every port, either port by port or as ranges per sweep."""
+        ports = self._ordered_ports()
+        if isinstance(ports, PortPermutation) and self.seed is None:
+            yield InfoMessage(f"Probing ports in random order, seed: {ports.seed}")
 
-        if self.with_udp:
-            if self._with_ipv4 and self.ipv4_addr:
-                for port, status in self._check_udp_ports(ports, ip_version=4):
-                    yield self._message_producer(port, "udp", status, self.ipv4_addr)
-            if self._with_ipv6 and self.ipv6_addr:
-                for port, status in self._check_udp_ports(ports, ip_version=6):
-                    yield self._message_producer(port, "udp", status, self.ipv6_addr)
+        report = self.report
+        if report == "auto":
+            report = "ports"
+            if len(ports) > self.RANGE_REPORT_THRESHOLD:
+                report = "ranges"
+
+        checkpoint = self._checkpoint(ports)
+        done = None
+        if checkpoint is not None and self.resume:
+            done = checkpoint.load()
+            if done is not None:
+                yield InfoMessage(f"Resuming from checkpoint {self.checkpoint_file}")
+                if report == "ports":
+                    yield from self._resumed_messages(done)
+
+        self.results = done.copy() if done is not None else PortStateMatrix()
+        completed = False
+        try:
+            sweep_results = self._schedule(
+                ports, ordered=report == "ports", done=done, checkpoint=checkpoint
+            )
+            for (protocol, ip_version), port, status in sweep_results:
+                if report == "ports":
+                    yield self._message_producer(
+                        port, protocol, status, self._host(ip_version)
+                    )
+            completed = True
+        finally:
+            if checkpoint is not None:
+                if completed:
+                    checkpoint.remove()
+                else:
+                    checkpoint.save(self.results)
+
+        if report == "ranges":
+            yield from self._range_messages(self._sweeps())
@@ -2,9 +2,16 @@ import cerberus
 import yaml
 
 from egress0r.constants import config_file
+from egress0r.ports import SPEC_REGEX
 from egress0r.utils import print_fail
 
 cfg = None
+IPV4_ADDR_RULES = {
+    "type": "string",
+    "empty": False,
+    "regex": r"^(\d{1,3}\.){3}\d{1,3}$",
+}
+IPV6_ADDR_RULES = {"type": "string", "empty": False, "regex": r"^[0-9a-fA-F:]+$"}
 
 
 def validate(config):
@@ -51,6 +58,34 @@ def validate(config):
                 "ftp": {"type": "boolean", "required": True},
             },
         },
+        "executor": {
+            "type": "dict",
+            "required": False,
+            "schema": {
+                "workers": {"type": "integer", "min": 1, "nullable": True},
+                "chunksize": {"type": "integer", "min": 1, "nullable": True},
+            },
+        },
+        "timing": {
+            "type": "dict",
+            "required": False,
+            "schema": {
+                "adaptive_timeouts": {"type": "boolean"},
+                "min_timeout": {"type": "number", "min": 0},
+                "min_samples": {"type": "integer", "min": 1},
+                "hedge_percentile": {"type": "number", "min": 0, "max": 1},
+            },
+        },
+        "rate_limit": {
+            "type": "dict",
+            "required": False,
+            "schema": {
+                "rate": {"type": "number", "nullable": True, "min": 1},
+                "burst": {"type": "number", "nullable": True, "min": 1},
+                "min_rate": {"type": "number", "min": 1},
+                "adaptive": {"type": "boolean"},
+            },
+        },
         "smtp": {
             "type": "dict",
             "required": True,
@@ -109,23 +144,48 @@ def validate(config):
             "type": "dict",
             "required": True,
             "schema": {
-                "mode": {"type": "string", "allowed": ["top10", "top100", "all"]},
-                "ipv4_addr": {
+                "mode": {
                     "type": "string",
+                    "allowed": ["top10", "top100", "all", "sample"],
+                },
+                "ipv4_addr": {
                     "required": True,
-                    "empty": False,
-                    "regex": r"^(\d{1,3}\.){3}\d{1,3}$",
+                    "anyof": [
+                        IPV4_ADDR_RULES,
+                        {"type": "list", "empty": False, "schema": IPV4_ADDR_RULES},
+                    ],
                 },
                 "ipv6_addr": {
-                    "type": "string",
                     "required": True,
-                    "empty": False,
-                    "regex": r"^[0-9a-fA-F:]+$",
+                    "anyof": [
+                        IPV6_ADDR_RULES,
+                        {"type": "list", "empty": False, "schema": IPV6_ADDR_RULES},
+                    ],
                 },
                 "with_tcp": {"type": "boolean", "required": True},
                 "tcp_timeout": {"type": "integer", "required": True, "min": 1},
                 "with_udp": {"type": "boolean", "required": True},
                 "udp_timeout": {"type": "integer", "required": True, "min": 1},
+                "engine": {"type": "string", "allowed": ["pool", "async"]},
+                "concurrency": {"type": "integer", "min": 1},
+                "tcp_method": {"type": "string", "allowed": ["connect", "syn"]},
+                "syn_rate": {"type": "integer", "min": 1},
+                "udp_method": {"type": "string", "allowed": ["socket", "mux"]},
+                "report": {"type": "string", "allowed": ["auto", "ports", "ranges"]},
+                "order": {"type": "string", "allowed": ["sequential", "random"]},
+                "seed": {"type": "integer", "nullable": True, "min": 0},
+                "checkpoint_file": {"type": "string", "nullable": True, "empty": False},
+                "checkpoint_interval": {"type": "integer", "min": 1},
+                "sample_size": {"type": "integer", "min": 1},
+                "sample_confidence": {"type": "float", "min": 0.5, "max": 0.999},
+                "udp_hedges": {"type": "integer", "min": 0},
+                "udp_hedge_delay": {"type": "number", "nullable": True, "min": 0.001},
+                "ports": {
+                    "type": "string",
+                    "nullable": True,
+                    "empty": False,
+                    "regex": SPEC_REGEX,
+                },
             },
         },
         "http": {
@@ -174,6 +234,12 @@ def validate(config):
             "required": True,
             "schema": {
                 "timeout": {"type": "integer", "required": True, "min": 1},
+                "hedges": {"type": "integer", "min": 0},
+                "hedge_delay": {"type": "number", "nullable": True, "min": 0.001},
+                "backend": {"type": "string", "allowed": ["auto", "raw", "dgram"]},
+                "discover_payload_size": {"type": "boolean"},
+                "max_payload_size": {"type": "integer", "nullable": True, "min": 0},
+                "burst": {"type": "integer", "min": 0},
                 "exfil": {
                     "type": "dict",
                     "required": True,
@@ -186,6 +252,8 @@ def validate(config):
                         },
                         "max_chunks": {"type": "integer", "min": 1, "required": True},
                         "chunk_size": {"type": "integer", "min": 1, "required": True},
+                        "window": {"type": "integer", "min": 1},
+                        "retries": {"type": "integer", "min": 0},
                     },
                 },
                 "target_hosts": {
@@ -205,6 +273,12 @@ def validate(config):
             "required": True,
             "schema": {
                 "timeout": {"type": "integer", "required": True, "min": 1},
+                "concurrency": {"type": "integer", "min": 1},
+                "transports": {
+                    "type": "list",
+                    "empty": False,
+                    "schema": {"type": "string", "allowed": ["udp", "tcp"]},
+                },
                 "servers": {
                     "type": "list",
                     "required": True,
@@ -239,7 +313,31 @@ def validate(config):
                             "allowed": ["A", "AAAA", "MX", "TXT"],
                         },
                         "max_chunks": {"type": "integer", "min": 1, "required": True},
-                        "chunk_size": {"type": "integer", "min": 1, "required": True},
+                        "chunk_size": {
+                            "required": True,
+                            "anyof": [
+                                {"type": "integer", "min": 1},
+                                {"type": "string", "allowed": ["auto"]},
+                            ],
+                        },
+                        "encoding": {
+                            "type": "string",
+                            "allowed": ["hex", "base32", "base36"],
+                        },
+                        "window": {"type": "integer", "min": 1},
+                        "retries": {"type": "integer", "min": 0},
+                        "transport": {"type": "string", "allowed": ["udp", "tcp"]},
+                    },
+                },
+                "ingress": {
+                    "type": "dict",
+                    "required": False,
+                    "nullable": True,
+                    "schema": {
+                        "record": {"type": "string", "nullable": True, "empty": False},
+                        "count": {"type": "integer", "min": 1},
+                        "payload_size": {"type": "integer", "min": 512, "max": 4096},
+                        "window": {"type": "integer", "min": 1},
                     },
                 },
                 "queries": {
@@ -0,0 +1,64 @@
+import base64
+import binascii
+import math
+import string
+
+
+class HexEncoder:
+    """Encode bytes as lowercase hex, two characters per byte."""
+
+    name = "hex"
+
+    def encode(self, data):
+        return binascii.hexlify(data).decode("ascii")
+
+    def encoded_length(self, size):
+        """Return the length of the encoding of size bytes."""
+        return size * 2
+
+
+class Base32Encoder:
+    """Encode bytes as unpadded lowercase base32, eight characters per five bytes.
+
+    >>> Base32Encoder().encode(b"egress0r")
+    'mvtxezltomyhe'
+    """
+
+    name = "base32"
+
+    def encode(self, data):
+        return base64.b32encode(data).decode("ascii").rstrip("=").lower()
+
+    def encoded_length(self, size):
+        return math.ceil(size * 8 / 5)
+
+
+class Base36Encoder:
+    """Encode bytes as a base36 number of digits and lowercase letters.
+
+    The data is prefixed with a 0x01 byte before the conversion so leading
+    null bytes survive the round trip.
+
+    >>> Base36Encoder().encode(b"egress0r")
+    '5fnx17ez6zmuq'
+    """
+
+    name = "base36"
+    ALPHABET = string.digits + string.ascii_lowercase
+
+    def encode(self, data):
+        number = int.from_bytes(b"\x01" + data, "big")
+        digits = []
+        while number:
+            number, digit = divmod(number, 36)
+            digits.append(self.ALPHABET[digit])
+        return "".join(reversed(digits))
+
+    def encoded_length(self, size):
+        # The largest number size bytes and the prefix byte can represent.
+        return len(self.encode(b"\xff" * size))
+
+
+ENCODERS = {
+    encoder.name: encoder for encoder in (HexEncoder, Base32Encoder, Base36Encoder)
+}
@@ -0,0 +1,5 @@
+from egress0r.engines.tcp import AsyncTCPEngine  # noqa
+from egress0r.engines.syn import SYNEngine  # noqa
+from egress0r.engines.udp import UDPMuxEngine  # noqa
+from egress0r.engines.icmp import ICMPEngine  # noqa
+from egress0r.engines.dnstcp import DNSTCPConnection  # noqa
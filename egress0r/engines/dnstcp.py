@@ -0,0 +1,112 @@
+import asyncio
+import random
+import struct
+
+import dns.exception
+import dns.message
+
+
+class DNSTCPConnection:
+    """Pipeline DNS queries over a single TCP connection to a nameserver.
+
+    As permitted by RFC 7766, queries are written as soon as they are made,
+    without waiting for the responses of the queries before them. The
+    server may answer in any order, responses are matched back to their
+    queries by message id, which is made unique among the queries in flight.
+
+    The connection is opened by the first query and opened again by the next
+    query once the server closed it, queries in flight at that moment fail
+    with a ConnectionError. Timeouts are up to the caller, e.g. by wrapping
+    query() in asyncio.wait_for().
+    """
+
+    PORT = 53
+
+    def __init__(self, nameserver, port=PORT):
+        self.nameserver = nameserver
+        self.port = port
+        self.connects = 0
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._pending = {}
+        self._lock = None
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _connect(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.connected:
+                return
+            reader, writer = await asyncio.open_connection(self.nameserver, self.port)
+            self._reader, self._writer = reader, writer
+            self._pending = {}
+            self.connects += 1
+            self._receiver = asyncio.ensure_future(
+                self._receive(reader, writer, self._pending)
+            )
+
+    async def _receive(self, reader, writer, pending):
+        """Hand the responses read from the connection to their queries."""
+        try:
+            while True:
+                (length,) = struct.unpack("!H", await reader.readexactly(2))
+                wire = await reader.readexactly(length)
+                try:
+                    response = dns.message.from_wire(wire)
+                except dns.exception.DNSException:
+                    continue
+                future = pending.get(response.id)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._reader = self._writer = None
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError(
+                            f"Connection to {self.nameserver} port {self.port} closed"
+                        )
+                    )
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def query(self, message):
+        """Send message, a dns.message.Message, returns the response to it."""
+        await self._connect()
+        pending, writer = self._pending, self._writer
+        while message.id in pending:
+            message.id = random.randrange(0x10000)
+        future = asyncio.get_running_loop().create_future()
+        pending[message.id] = future
+        try:
+            wire = message.to_wire()
+            writer.write(struct.pack("!H", len(wire)) + wire)
+            await writer.drain()
+            response = await future
+        finally:
+            del pending[message.id]
+        if not message.is_response(response):
+            raise dns.exception.FormError(
+                f"Unexpected response from {self.nameserver} to query {message.id}"
+            )
+        return response
+
+    async def close(self):
+        """Close the connection, queries still in flight are cancelled."""
+        for future in self._pending.values():
+            future.cancel()
+        if self._receiver is not None:
+            self._receiver.cancel()
+            await asyncio.gather(self._receiver, return_exceptions=True)
+            self._receiver = None
@@ -0,0 +1,441 @@
+import collections
+import heapq
+import random
+import selectors
+import socket
+import struct
+import time
+from ipaddress import ip_address
+
+from egress0r.engines.packet import (
+    ProbeLoopMixin,
+    address_family,
+    checksum,
+    ping_sockets_permitted,
+    set_dont_fragment,
+    strip_ipv4_header,
+)
+from egress0r.ratelimit import TokenBucket
+from egress0r.rtt import LossStats, RTTEstimator
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+ECHO_HEADER = struct.Struct("!BBHHH")
+
+Echo = collections.namedtuple("Echo", ["addr", "seq", "payload", "rtt", "received"])
+
+
+class _Exchange:
+    """The state of a single ICMPEngine.exchange() call."""
+
+    def __init__(self, selector):
+        self.selector = selector
+        self.requests = {}
+        self.sent_at = {}
+        self.attempts = {}
+        self.replies = {}
+        self.failed = set()
+        self.due = []
+
+
+class ICMPEngine(ProbeLoopMixin):
+    """Send ICMP echo requests to many targets at once from raw sockets.
+
+    A single raw socket per address family sends all requests and receives
+    all replies. Every request carries the engine's random identifier and a
+    sequence number, replies are matched back to their request by sender,
+    identifier and sequence number, so any number of requests to any number
+    of targets can be in flight at once: a round of requests takes about one
+    timeout, no matter how many targets there are.
+
+    The timeout of a round is derived from the RTTEstimator of its targets,
+    ``estimators`` maps a target to one, ``timeout`` being the upper bound.
+    Requests are sent as fast as the optional TokenBucket permits. Up to
+    ``hedges`` duplicates of an unanswered request are sent, each one
+    ``hedge_delay`` seconds after the previous one, by default after the
+    target's hedge percentile. Duplicates share the sequence number, the
+    first reply counts. The outcome of every request is recorded in the
+    optional LossStats.
+
+    The ``raw`` backend requires root or CAP_NET_RAW. The ``dgram`` backend
+    uses the kernel's ping sockets instead, which unprivileged users may open
+    if their group is within net.ipv4.ping_group_range. The kernel then
+    replaces the identifier with one of its own and only hands the socket the
+    replies carrying it. ``auto`` picks ``dgram`` where permitted.
+
+    With ``dont_fragment`` set, requests are sent with the DF bit set where
+    the platform supports it, requests above the path MTU known to the
+    kernel fail right away.
+    """
+
+    MAX_PACKET_SIZE = 65535
+    VALID_BACKENDS = ("auto", "raw", "dgram")
+    DEFAULT_BACKEND = "auto"
+    DEFAULT_SEARCH_PROBES = 7
+    MAX_PAYLOAD_SIZE = {socket.AF_INET: 65507, socket.AF_INET6: 65527}
+
+    def __init__(
+        self,
+        timeout,
+        estimators=None,
+        limiter=None,
+        hedges=0,
+        hedge_delay=None,
+        stats=None,
+        backend=DEFAULT_BACKEND,
+        dont_fragment=False,
+    ):
+        if backend not in self.VALID_BACKENDS:
+            raise ValueError(
+                f"ICMPEngine expects argument backend to be one of "
+                f"{self.VALID_BACKENDS}, got {backend!r}"
+            )
+        if backend == "auto":
+            backend = "dgram" if ping_sockets_permitted() else "raw"
+        self.backend = backend
+        self.dont_fragment = dont_fragment
+        self.timeout = timeout
+        self.estimators = estimators or (lambda addr: RTTEstimator(enabled=False))
+        self.limiter = limiter or TokenBucket()
+        self.hedges = max(0, int(hedges))
+        self.hedge_delay = hedge_delay
+        self.stats = stats or LossStats()
+        self.ident = random.randint(1, 0xFFFF)
+        self._seq = random.randint(0, 0xFFFF)
+        self._sockets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for sock in self._sockets.values():
+            sock.close()
+        self._sockets.clear()
+
+    def next_seq(self):
+        """Return the next sequence number, wrapping around at 16 bits."""
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    def _socket(self, family):
+        if family not in self._sockets:
+            proto = socket.IPPROTO_ICMPV6
+            if family == socket.AF_INET:
+                proto = socket.IPPROTO_ICMP
+            sock_type = socket.SOCK_RAW
+            if self.backend == "dgram":
+                sock_type = socket.SOCK_DGRAM
+            sock = socket.socket(family, sock_type, proto)
+            sock.setblocking(False)
+            if self.dont_fragment:
+                set_dont_fragment(sock)
+            self._sockets[family] = sock
+        return self._sockets[family]
+
+    def _build_request(self, family, seq, payload):
+        request_type = ICMP_ECHO_REQUEST
+        if family == socket.AF_INET6:
+            request_type = ICMPV6_ECHO_REQUEST
+        header = ECHO_HEADER.pack(request_type, 0, 0, self.ident, seq)
+        if family == socket.AF_INET6 or self.backend == "dgram":
+            # The kernel fills in the checksum of ICMPv6 and ping sockets.
+            return header + payload
+        csum = checksum(header + payload)
+        return ECHO_HEADER.pack(request_type, 0, csum, self.ident, seq) + payload
+
+    def _parse_reply(self, family, data):
+        """Extract (seq, payload) from a received packet, None if it isn't ours."""
+        reply_type = ICMPV6_ECHO_REPLY
+        if family == socket.AF_INET:
+            reply_type = ICMP_ECHO_REPLY
+            if self.backend == "raw":
+                data = strip_ipv4_header(data)
+        if len(data) < ECHO_HEADER.size:
+            return None
+        type_, code, _, ident, seq = ECHO_HEADER.unpack_from(data)
+        # Ping sockets only receive the replies to their own requests.
+        ours = self.backend == "dgram" or ident == self.ident
+        if type_ != reply_type or code != 0 or not ours:
+            return None
+        return seq, data[ECHO_HEADER.size :]
+
+    def _receive(self, exchange, wait):
+        for key, _ in exchange.selector.select(max(0, wait)):
+            sock = key.fileobj
+            while True:
+                try:
+                    data, sender = sock.recvfrom(self.MAX_PACKET_SIZE)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    continue
+                reply = self._parse_reply(sock.family, data)
+                if reply is None:
+                    continue
+                seq, payload = reply
+                request = (str(ip_address(sender[0])), seq)
+                if request not in exchange.requests or request in exchange.replies:
+                    continue
+                received = time.monotonic()
+                elapsed = received - exchange.sent_at[request]
+                addr = exchange.requests[request][0]
+                exchange.replies[request] = Echo(addr, seq, payload, elapsed, received)
+                if exchange.attempts[request] == 1:
+                    self.estimators(addr).add_sample(elapsed)
+
+    def _send(self, exchange, request):
+        addr, payload, delay = exchange.requests[request]
+        family = address_family(addr)
+        packet = self._build_request(family, request[1], payload)
+        while True:
+            try:
+                self._socket(family).sendto(packet, (addr, 0))
+                break
+            except (BlockingIOError, InterruptedError):
+                self._receive(exchange, 0.01)
+            except OSError:
+                # E.g. no route to the target or a request above the path MTU
+                # with DF set, it can't be answered.
+                exchange.failed.add(request)
+                break
+        exchange.sent_at.setdefault(request, time.monotonic())
+        exchange.attempts[request] = exchange.attempts.get(request, 0) + 1
+        if request in exchange.failed:
+            return
+        if exchange.attempts[request] <= self.hedges:
+            self._schedule_hedge(exchange, request, delay)
+
+    def _answered(self, exchange, request):
+        return request in exchange.replies
+
+    def _resend(self, exchange, request):
+        self._send(exchange, request)
+
+    def _wait(self, exchange, until, until_answered=False):
+        """Receive replies and send due duplicates until the given time."""
+        while not (
+            until_answered
+            and len(exchange.replies) + len(exchange.failed) >= len(exchange.sent_at)
+        ):
+            self._send_hedges(exchange)
+            now = time.monotonic()
+            if now >= until:
+                return
+            wake = min(until, exchange.due[0][0]) if exchange.due else until
+            self._receive(exchange, wake - now)
+
+    def _timeouts(self, addrs):
+        """Return a dict mapping each of addrs to its timeout."""
+        return {
+            addr: self.estimators(addr).timeout(self.timeout) for addr in set(addrs)
+        }
+
+    def _add_request(self, exchange, addr, seq, payload, timeout):
+        """Register a request with the exchange, returns its (peer, seq) key."""
+        delay = self.hedge_delay or self.estimators(addr).hedge_delay(
+            timeout, self.hedges
+        )
+        request = (str(ip_address(addr)), seq)
+        # Sequence numbers wrap around, forget whatever used this one before.
+        for state in (exchange.replies, exchange.sent_at, exchange.attempts):
+            state.pop(request, None)
+        exchange.failed.discard(request)
+        exchange.requests[request] = (addr, bytes(payload), delay)
+        sock = self._socket(address_family(addr))
+        if sock not in exchange.selector.get_map():
+            exchange.selector.register(sock, selectors.EVENT_READ)
+        return request
+
+    def _record(self, answered, attempts):
+        """Feed the outcome of a request to the LossStats and the TokenBucket."""
+        self.stats.record(answered, attempts)
+        self.limiter.report(not answered)
+
+    def exchange(self, requests, record=True):
+        """Send the (addr, seq, payload) requests and wait for their replies.
+
+        Returns a dict mapping (addr, seq) to the Echo replying to the
+        request, unanswered requests are missing from it. Unless record is
+        False, e.g. for requests which are expected to fail, their outcomes
+        are recorded as loss.
+        """
+        requests = list(requests)
+        timeouts = self._timeouts(addr for addr, _, _ in requests)
+        exchange = _Exchange(selectors.DefaultSelector())
+        try:
+            for addr, seq, payload in requests:
+                request = self._add_request(
+                    exchange, addr, seq, payload, timeouts[addr]
+                )
+                self._wait(exchange, time.monotonic() + self.limiter.take())
+                self._send(exchange, request)
+                self._receive(exchange, 0)
+            timeout = max(timeouts.values(), default=0)
+            self._wait(exchange, time.monotonic() + timeout, until_answered=True)
+        finally:
+            exchange.selector.close()
+        if record:
+            for request, attempts in exchange.attempts.items():
+                self._record(request in exchange.replies, attempts)
+        return {
+            (exchange.requests[request][0], request[1]): echo
+            for request, echo in exchange.replies.items()
+        }
+
+    def ping(self, targets, payload=b""):
+        """Send one echo request to every target at once.
+
+        Returns a dict mapping each target to its Echo, None if it didn't reply.
+        """
+        targets = list(targets)
+        requests = [(addr, self.next_seq(), payload) for addr in targets]
+        replies = self.exchange(requests)
+        return {addr: replies.get((addr, seq)) for addr, seq, _ in requests}
+
+    def burst(self, targets, count, payload=b""):
+        """Send count echo requests to every target at once, interleaving
+        the targets.
+
+        Returns a dict mapping each target to the round trip times of its
+        requests in sending order, None for the unanswered ones.
+        """
+        targets = list(targets)
+        requests = [
+            (addr, self.next_seq(), payload) for _ in range(count) for addr in targets
+        ]
+        replies = self.exchange(requests)
+        rtts = {addr: [] for addr in targets}
+        for addr, seq, _ in requests:
+            echo = replies.get((addr, seq))
+            rtts[addr].append(echo.rtt if echo is not None else None)
+        return rtts
+
+    def transfer(self, requests, window=1, retries=0):
+        """Send the (addr, payload) requests, keeping up to window of them in
+        flight per target.
+
+        Requests to a target are sent in order, each with its own sequence
+        number, and replies are matched in whatever order they arrive. A
+        request left unanswered for the timeout is sent again, up to retries
+        times, while later requests keep flowing. Returns a list with the
+        Echo of every request, None for the ones which stayed unanswered.
+        """
+        requests = list(requests)
+        window = max(1, int(window))
+        timeouts = self._timeouts(addr for addr, _ in requests)
+        pending = collections.OrderedDict()
+        for index, (addr, _) in enumerate(requests):
+            pending.setdefault(addr, collections.deque()).append(index)
+        results = [None] * len(requests)
+        in_flight = {}
+        per_target = collections.Counter()
+        expiries = []
+        tries = collections.Counter()
+        exchange = _Exchange(selectors.DefaultSelector())
+
+        def finish(index):
+            request = in_flight.pop(index)
+            per_target[requests[index][0]] -= 1
+            results[index] = exchange.replies.get(request)
+            self._record(results[index] is not None, exchange.attempts[request])
+
+        try:
+            while any(pending.values()) or in_flight:
+                for index, request in list(in_flight.items()):
+                    if request in exchange.replies:
+                        finish(index)
+
+                while expiries and expiries[0][0] <= time.monotonic():
+                    _, index = heapq.heappop(expiries)
+                    if index not in in_flight:
+                        continue
+                    if tries[index] > retries:
+                        finish(index)
+                        continue
+                    addr = requests[index][0]
+                    self._wait(exchange, time.monotonic() + self.limiter.take())
+                    self._send(exchange, in_flight[index])
+                    tries[index] += 1
+                    expiry = time.monotonic() + timeouts[addr]
+                    heapq.heappush(expiries, (expiry, index))
+
+                for addr, indexes in pending.items():
+                    while indexes and per_target[addr] < window:
+                        index = indexes.popleft()
+                        request = self._add_request(
+                            exchange,
+                            addr,
+                            self.next_seq(),
+                            requests[index][1],
+                            timeouts[addr],
+                        )
+                        self._wait(exchange, time.monotonic() + self.limiter.take())
+                        self._send(exchange, request)
+                        in_flight[index] = request
+                        per_target[addr] += 1
+                        tries[index] = 1
+                        expiry = time.monotonic() + timeouts[addr]
+                        heapq.heappush(expiries, (expiry, index))
+
+                if not in_flight:
+                    continue
+                self._send_hedges(exchange)
+                wake = expiries[0][0]
+                if exchange.due:
+                    wake = min(wake, exchange.due[0][0])
+                self._receive(exchange, wake - time.monotonic())
+        finally:
+            exchange.selector.close()
+        return results
+
+    def discover_payload_size(
+        self, targets, upper_bound=None, probes=DEFAULT_SEARCH_PROBES
+    ):
+        """Search the largest echo payload every target returns unmodified.
+
+        All targets are searched at once. Every round sends ``probes``
+        requests per target, their sizes evenly spread between the largest
+        size known to work and the smallest one known to fail, so the search
+        takes about log(upper_bound) / log(probes + 1) rounds of one timeout
+        each. Combine with ``dont_fragment`` to find the largest payload which
+        passes without fragmentation. Returns a dict mapping each target to
+        the payload size, None if not even empty requests were answered.
+        """
+        bounds = {}
+        for addr in targets:
+            limit = self.MAX_PAYLOAD_SIZE[address_family(addr)]
+            bounds[addr] = [-1, min(limit, upper_bound or limit) + 1]
+        while True:
+            requests = []
+            sizes = {}
+            for addr, (low, high) in bounds.items():
+                step = max(1, (high - low) // (probes + 1))
+                for size in range(max(0, low + step), high, step)[:probes]:
+                    seq = self.next_seq()
+                    sizes[addr, seq] = size
+                    requests.append((addr, seq, self._pattern(size)))
+            if not requests:
+                break
+            replies = self.exchange(requests, record=False)
+            answered = collections.defaultdict(list)
+            failed = collections.defaultdict(list)
+            for (addr, seq), size in sizes.items():
+                echo = replies.get((addr, seq))
+                if echo is not None and echo.payload == self._pattern(size):
+                    answered[addr].append(size)
+                else:
+                    failed[addr].append(size)
+            for addr, bound in bounds.items():
+                bound[0] = max(answered[addr], default=bound[0])
+                above = [size for size in failed[addr] if size > bound[0]]
+                bound[1] = min(above, default=bound[1])
+        return {addr: low if low >= 0 else None for addr, (low, _) in bounds.items()}
+
+    @staticmethod
+    def _pattern(size):
+        return (bytes(range(256)) * (size // 256 + 1))[:size]
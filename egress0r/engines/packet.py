@@ -0,0 +1,160 @@
+import heapq
+import os
+import socket
+import struct
+import time
+
+from egress0r.utils import is_ipv6_addr
+
+# Not every Python build exposes these, the values are fixed by the Linux ABI.
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+IPV6_RECVERR = getattr(socket, "IPV6_RECVERR", 25)
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+IPV6_DONTFRAG = getattr(socket, "IPV6_DONTFRAG", 62)
+SOCK_EXTENDED_ERR = struct.Struct("=IBBBBII")
+PING_GROUP_RANGE_FILE = "/proc/sys/net/ipv4/ping_group_range"
+
+
+class ProbeLoopMixin:
+    """Pacing, hedging and loss reporting of engines with many probes in flight.
+
+    The engine has a TokenBucket in self.limiter and implements
+    _receive(state, wait), receiving answers for the state of a run for up
+    to wait seconds. Duplicates are scheduled in state.due, a heap of
+    (time, key) tuples, _answered(state, key) tells if the probe key got an
+    answer and _resend(state, key) sends its duplicate.
+    """
+
+    def _pace(self, state):
+        """Take a token from the limiter, receiving until it is available."""
+        until = time.monotonic() + self.limiter.take()
+        while time.monotonic() < until:
+            self._receive(state, until - time.monotonic())
+
+    def _schedule_hedge(self, state, key, delay):
+        heapq.heappush(state.due, (time.monotonic() + delay, key))
+
+    def _send_hedges(self, state):
+        """Send a duplicate of every unanswered probe whose hedge delay passed."""
+        while state.due and state.due[0][0] <= time.monotonic():
+            _, key = heapq.heappop(state.due)
+            if self._answered(state, key):
+                continue
+            self._pace(state)
+            if not self._answered(state, key):
+                self._resend(state, key)
+
+    def _expire(self, outstanding, timeout):
+        """Report the probes whose timeout passed unanswered as lost.
+
+        outstanding maps the unanswered probes to the time they were first
+        sent, in sending order.
+        """
+        deadline = time.monotonic() - timeout
+        while outstanding:
+            key, sent = next(iter(outstanding.items()))
+            if sent > deadline:
+                return
+            del outstanding[key]
+            self.limiter.report(True)
+
+
+def address_family(addr):
+    """Return the socket address family matching the IP address string."""
+    if is_ipv6_addr(addr):
+        return socket.AF_INET6
+    return socket.AF_INET
+
+
+def checksum(data):
+    """Calculate the internet checksum (RFC 1071) of the given bytes."""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def source_address(addr):
+    """Determine the local address the kernel would use to reach addr."""
+    with socket.socket(address_family(addr), socket.SOCK_DGRAM) as sock:
+        sock.connect((addr, 9))
+        return sock.getsockname()[0]
+
+
+def strip_ipv4_header(data):
+    """Return the payload of a raw IPv4 packet, stripping its header."""
+    if len(data) < 20:
+        return b""
+    header_length = (data[0] & 0x0F) * 4
+    return data[header_length:]
+
+
+def enable_error_queue(sock):
+    """Make the kernel queue ICMP errors for datagrams sent from sock.
+    Returns False if the platform doesn't support it.
+    """
+    try:
+        if sock.family == socket.AF_INET6:
+            sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+    except OSError:
+        return False
+    return hasattr(socket, "MSG_ERRQUEUE")
+
+
+def read_error_queue(sock):
+    """Drain the error queue of sock.
+
+    Yields (address, errno) tuples, address being the destination of the
+    datagram which triggered the error and errno its translated ICMP error,
+    e.g. ECONNREFUSED for port unreachable.
+    """
+    while True:
+        try:
+            _, ancdata, _, address = sock.recvmsg(
+                512, 512, socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT
+            )
+        except (BlockingIOError, InterruptedError):
+            return
+        for level, type_, data in ancdata:
+            if (level, type_) not in (
+                (socket.IPPROTO_IP, IP_RECVERR),
+                (socket.IPPROTO_IPV6, IPV6_RECVERR),
+            ):
+                continue
+            if len(data) >= SOCK_EXTENDED_ERR.size:
+                yield address, SOCK_EXTENDED_ERR.unpack_from(data)[0]
+
+
+def set_dont_fragment(sock):
+    """Set the don't fragment bit on packets sent from sock, oversized packets
+    then fail with EMSGSIZE instead of being fragmented. Returns False if the
+    platform doesn't support it.
+    """
+    try:
+        if sock.family == socket.AF_INET6:
+            sock.setsockopt(socket.IPPROTO_IPV6, IPV6_DONTFRAG, 1)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    except OSError:
+        return False
+    return True
+
+
+def ping_sockets_permitted():
+    """Determine if unprivileged ICMP ping sockets may be opened.
+
+    Linux only allows them for the groups within net.ipv4.ping_group_range,
+    which applies to IPv6 as well. The range is empty by default.
+    """
+    try:
+        with open(PING_GROUP_RANGE_FILE) as fin:
+            low, high = (int(gid) for gid in fin.read().split())
+    except (OSError, ValueError):
+        return False
+    groups = {os.getgid(), os.getegid(), *os.getgroups()}
+    return any(low <= gid <= high for gid in groups)
@@ -0,0 +1,191 @@
+import collections
+import functools
+import random
+import select
+import socket
+import struct
+import time
+from ipaddress import ip_address
+
+from egress0r.engines.packet import (
+    ProbeLoopMixin,
+    address_family,
+    checksum,
+    source_address,
+    strip_ipv4_header,
+)
+from egress0r.portstate import PortState
+from egress0r.ratelimit import TokenBucket
+from egress0r.rtt import RTTEstimator
+
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+
+class SYNEngine(ProbeLoopMixin):
+    """Probe TCP ports with half-open SYN scans from a raw socket.
+
+    A single raw IPPROTO_TCP socket is used both to send the SYN probes at a
+    fixed rate and to receive the answers: the kernel hands a copy of every
+    incoming TCP segment to raw sockets, so no extra sniffer is needed. The
+    initial sequence number of each probe is derived from its port, answers
+    are matched back to the probed port through their acknowledgement number.
+
+    Answers are collected until the timeout, or the one derived by the
+    optional RTTEstimator, passed after the last probe was sent. An optional
+    TokenBucket shared with other probes can slow the rate down further, the
+    outcome of every probe is reported to it as soon as it is known, i.e.
+    while later probes are still being sent.
+
+    Requires root or CAP_NET_RAW.
+    """
+
+    DEFAULT_RATE = 1000
+    WINDOW_SIZE = 1024
+
+    def __init__(self, addr, timeout, rate=DEFAULT_RATE, rtt=None, limiter=None):
+        self.addr = addr
+        self.timeout = timeout
+        self.rate = max(1, int(rate))
+        self.rtt = rtt or RTTEstimator(enabled=False)
+        self.limiter = limiter or TokenBucket()
+        self.family = address_family(addr)
+        self._peer = str(ip_address(addr))
+        self._secret = random.getrandbits(32)
+        self._sport = random.randint(40000, 60999)
+
+    def _sequence_number(self, port):
+        return (self._secret ^ (port * 2654435761)) & 0xFFFFFFFF
+
+    def _open_socket(self):
+        sock = socket.socket(self.family, socket.SOCK_RAW, socket.IPPROTO_TCP)
+        if self.family == socket.AF_INET6:
+            # Let the kernel fill in the checksum, it knows the IPv6 pseudo header.
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_CHECKSUM, 16)
+        sock.setblocking(False)
+        return sock
+
+    def _build_syn(self, port, src):
+        header = struct.pack(
+            "!HHIIBBHHH",
+            self._sport,
+            port,
+            self._sequence_number(port),
+            0,
+            5 << 4,
+            TCP_SYN,
+            self.WINDOW_SIZE,
+            0,
+            0,
+        )
+        if self.family == socket.AF_INET6:
+            return header
+        pseudo_header = struct.pack(
+            "!4s4sBBH",
+            socket.inet_pton(socket.AF_INET, src),
+            socket.inet_pton(socket.AF_INET, self.addr),
+            0,
+            socket.IPPROTO_TCP,
+            len(header),
+        )
+        csum = checksum(pseudo_header + header)
+        return header[:16] + struct.pack("!H", csum) + header[18:]
+
+    def _parse_reply(self, data, sender):
+        """Map a received segment to (port, flags) or None if it isn't ours."""
+        if sender != self._peer:
+            return None
+        if self.family == socket.AF_INET:
+            data = strip_ipv4_header(data)
+        if len(data) < 20:
+            return None
+        sport, dport, _, ack, _, flags = struct.unpack("!HHIIBB", data[:14])
+        if dport != self._sport or not flags & TCP_ACK:
+            return None
+        if (ack - 1) & 0xFFFFFFFF != self._sequence_number(sport):
+            return None
+        return sport, flags
+
+    def _receive(self, sock, replies, sent_at, outstanding, wait):
+        readable, _, _ = select.select([sock], [], [], max(0, wait))
+        if not readable:
+            return
+        while True:
+            try:
+                data, sender = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            reply = self._parse_reply(data, sender[0])
+            if reply is not None and reply[0] not in replies:
+                port, flags = reply
+                replies[port] = flags
+                if port in sent_at:
+                    self.rtt.add_sample(time.monotonic() - sent_at[port])
+                if outstanding.pop(port, None) is not None:
+                    self.limiter.report(False)
+
+    def scan(self, ports):
+        """Send a SYN to every port, returns a dict mapping ports to TCP flags.
+
+        Ports which didn't answer within the timeout are missing from the dict.
+        """
+        src = source_address(self.addr)
+        interval = 1.0 / self.rate
+        replies = {}
+        sent_at = {}
+        # Unanswered probes in sending order, mapped to the time they were sent.
+        outstanding = collections.OrderedDict()
+        with self._open_socket() as sock:
+            receive = functools.partial(
+                self._receive, sock, replies, sent_at, outstanding
+            )
+            next_send = time.monotonic()
+            for port in ports:
+                next_send = max(next_send, time.monotonic() + self.limiter.take())
+                receive(next_send - time.monotonic())
+                while time.monotonic() < next_send:
+                    receive(next_send - time.monotonic())
+                self._expire(outstanding, self.rtt.timeout(self.timeout))
+                packet = self._build_syn(port, src)
+                while True:
+                    try:
+                        sock.sendto(packet, (self.addr, 0))
+                        sent_at[port] = time.monotonic()
+                        if port not in replies:
+                            outstanding[port] = sent_at[port]
+                        break
+                    except (BlockingIOError, InterruptedError):
+                        receive(interval)
+                next_send = max(next_send + interval, time.monotonic())
+
+            deadline = time.monotonic() + self.rtt.timeout(self.timeout)
+            while time.monotonic() < deadline and len(replies) < len(sent_at):
+                receive(deadline - time.monotonic())
+        for _ in outstanding:
+            self.limiter.report(True)
+        return replies
+
+    def sweep(self, ports, verify):
+        """Scan all ports, yields (port, PortState) tuples in the order of ``ports``.
+
+        Ports answering with a SYN-ACK are passed on to ``verify``, a callable
+        taking a list of ports and yielding (port, PortState) tuples, the
+        connection based banner check has the final say for those. Ports
+        answering with a RST are closed, silent ones are filtered.
+        """
+        ports = tuple(ports)
+        replies = self.scan(ports)
+        candidates = [
+            port
+            for port in ports
+            if replies.get(port, 0) & (TCP_SYN | TCP_ACK) == TCP_SYN | TCP_ACK
+        ]
+        verified = dict(verify(candidates)) if candidates else {}
+        for port in ports:
+            if port in verified:
+                yield port, verified[port]
+            elif replies.get(port, 0) & TCP_RST:
+                yield port, PortState.CLOSED
+            else:
+                yield port, PortState.FILTERED
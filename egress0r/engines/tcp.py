@@ -0,0 +1,127 @@
+import asyncio
+import time
+import urllib.parse
+
+from egress0r.portstate import PortState
+from egress0r.ratelimit import TokenBucket
+from egress0r.rtt import RTTEstimator
+from egress0r.utils import ip_to_url
+
+
+async def _new_queue():
+    """Create an asyncio.Queue bound to the currently running event loop."""
+    return asyncio.Queue()
+
+
+class AsyncTCPEngine:
+    """Check TCP ports concurrently from a single asyncio event loop.
+
+    Instead of one process and one curl handle per port, a fixed number of
+    coroutines share the port iterator and keep up to ``concurrency``
+    connections in flight at once. Every connection sends the same plain
+    HTTP request curl would send and the port only counts as reached if the
+    "Port: N reached." banner shows up in the response.
+
+    If an RTTEstimator is passed, each connection's timeout is derived from
+    the round trip times of the ports reached so far, with ``timeout`` being
+    the upper bound. If a TokenBucket is passed, connections are only opened
+    as fast as it permits.
+    """
+
+    DEFAULT_CONCURRENCY = 500
+    USER_AGENT = "curl/7.59.0"
+    MAX_RESPONSE_SIZE = 64 * 1024
+
+    def __init__(
+        self, addr, timeout, concurrency=DEFAULT_CONCURRENCY, rtt=None, limiter=None
+    ):
+        self.addr = addr
+        self.timeout = timeout
+        self.concurrency = max(1, int(concurrency))
+        self.rtt = rtt or RTTEstimator(enabled=False)
+        self.limiter = limiter or TokenBucket()
+
+    def _build_request(self, port):
+        host = urllib.parse.urlsplit(ip_to_url(self.addr, port=port)).netloc
+        return (
+            f"GET / HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            f"User-Agent: {self.USER_AGENT}\r\n"
+            f"Accept: */*\r\n"
+            f"Connection: close\r\n"
+            f"\r\n"
+        ).encode("ascii")
+
+    async def _exchange(self, port):
+        keyword = f"Port: {port} reached.".encode("ascii")
+        reader, writer = await asyncio.open_connection(self.addr, port)
+        try:
+            writer.write(self._build_request(port))
+            await writer.drain()
+            response = b""
+            while keyword not in response and len(response) < self.MAX_RESPONSE_SIZE:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                response += data
+            return PortState.OPEN if keyword in response else PortState.FILTERED
+        finally:
+            writer.close()
+
+    async def _probe(self, port):
+        wait = self.limiter.take()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        started = time.monotonic()
+        try:
+            state = await asyncio.wait_for(
+                self._exchange(port), self.rtt.timeout(self.timeout)
+            )
+        except ConnectionRefusedError:
+            return PortState.CLOSED
+        except (asyncio.TimeoutError, OSError, UnicodeError):
+            return PortState.FILTERED
+        if state is PortState.OPEN:
+            self.rtt.add_sample(time.monotonic() - started)
+        return state
+
+    async def _worker(self, port_iter, queue):
+        try:
+            for index, port in port_iter:
+                status = await self._probe(port)
+                await queue.put((index, port, status))
+        finally:
+            queue.put_nowait(None)
+
+    def sweep(self, ports):
+        """Check all ports, yields (port, PortState) tuples in the order of ``ports``."""
+        loop = asyncio.new_event_loop()
+        workers = []
+        try:
+            queue = loop.run_until_complete(_new_queue())
+            port_iter = enumerate(ports)
+            workers = [
+                loop.create_task(self._worker(port_iter, queue))
+                for _ in range(self.concurrency)
+            ]
+            finished = 0
+            buffered = {}
+            next_index = 0
+            while finished < len(workers):
+                item = loop.run_until_complete(queue.get())
+                if item is None:
+                    finished += 1
+                    continue
+                index, port, status = item
+                buffered[index] = (port, status)
+                while next_index in buffered:
+                    yield buffered.pop(next_index)
+                    next_index += 1
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if workers:
+                loop.run_until_complete(
+                    asyncio.gather(*workers, return_exceptions=True)
+                )
+            loop.close()
@@ -0,0 +1,222 @@
+import collections
+import errno
+import selectors
+import socket
+import time
+from ipaddress import ip_address
+
+from egress0r.engines.packet import (
+    ProbeLoopMixin,
+    address_family,
+    enable_error_queue,
+    read_error_queue,
+)
+from egress0r.portstate import PortState
+from egress0r.ratelimit import TokenBucket
+from egress0r.rtt import LossStats, RTTEstimator
+
+
+class _Scan:
+    """The state of a single UDPMuxEngine.scan() call."""
+
+    def __init__(self, selector, delay, timeout):
+        self.selector = selector
+        self.delay = delay
+        self.timeout = timeout
+        self.results = {}
+        # Unanswered ports in sending order, mapped to their first send time.
+        self.outstanding = collections.OrderedDict()
+        self.sent_at = {}
+        self.sockets = {}
+        self.attempts = {}
+        self.answered = {}
+        self.due = []
+
+
+class UDPMuxEngine(ProbeLoopMixin):
+    """Probe UDP ports from a handful of shared non-blocking sockets.
+
+    Every port gets a small datagram carrying the check's identifier and the
+    probed port as a token. All probes are sent first, a single receive loop
+    then matches the echoed tokens back to their ports until one global
+    deadline passes, so a whole sweep takes about one timeout.
+
+    ICMP errors triggered by the probes are collected from the sockets' error
+    queues, ports rejected with a port unreachable are closed, ports rejected
+    for any other reason are filtered, both without waiting for the deadline.
+
+    The deadline is derived from the optional RTTEstimator, with ``timeout``
+    being the upper bound. Probes are sent as fast as the optional TokenBucket
+    permits, answers are received while waiting for it. The outcome of every
+    probe is reported to the TokenBucket as soon as it is known, a probe is
+    lost once ``timeout`` passed since it was first sent.
+
+    Up to ``hedges`` duplicates of an unanswered probe are sent, each one
+    ``hedge_delay`` seconds after the previous one, by default after the
+    RTTEstimator's hedge percentile. How many probes needed a duplicate and
+    how many went unanswered is recorded in the optional LossStats.
+    """
+
+    DEFAULT_SOCKETS = 4
+    MAX_DATAGRAM_SIZE = 2048
+
+    def __init__(
+        self,
+        addr,
+        timeout,
+        identifier,
+        sockets=DEFAULT_SOCKETS,
+        rtt=None,
+        limiter=None,
+        hedges=0,
+        hedge_delay=None,
+        stats=None,
+    ):
+        self.addr = addr
+        self.timeout = timeout
+        self.rtt = rtt or RTTEstimator(enabled=False)
+        self.limiter = limiter or TokenBucket()
+        self.hedges = max(0, int(hedges))
+        self.hedge_delay = hedge_delay
+        self.stats = stats or LossStats()
+        self.family = address_family(addr)
+        self._peer = str(ip_address(addr))
+        self.sockets = max(1, int(sockets))
+        self._prefix = f"{identifier}:".encode("ascii")
+        self._with_error_queue = False
+
+    def _build_payload(self, port):
+        return self._prefix + str(port).encode("ascii")
+
+    def _parse_payload(self, data):
+        """Extract the port token of an echoed probe, None if it isn't ours."""
+        start = data.find(self._prefix)
+        if start < 0:
+            return None
+        token = data[start + len(self._prefix) :].split(b":", 1)[0]
+        try:
+            return int(token)
+        except ValueError:
+            return None
+
+    def _open_socket(self):
+        sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        self._with_error_queue = enable_error_queue(sock)
+        return sock
+
+    def _settle(self, scan, port, state):
+        """Record the state of an answered port."""
+        scan.results[port] = state
+        if scan.outstanding.pop(port, None) is not None:
+            self.limiter.report(False)
+
+    def _read_errors(self, scan, sock):
+        for address, error in read_error_queue(sock):
+            if str(ip_address(address[0])) != self._peer:
+                continue
+            port = address[1]
+            if scan.results.get(port) is PortState.OPEN:
+                continue
+            if error == errno.ECONNREFUSED:
+                self._settle(scan, port, PortState.CLOSED)
+            else:
+                self._settle(scan, port, PortState.FILTERED)
+
+    def _receive(self, scan, wait):
+        for key, _ in scan.selector.select(max(0, wait)):
+            sock = key.fileobj
+            while True:
+                try:
+                    data, sender = sock.recvfrom(self.MAX_DATAGRAM_SIZE)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    # A pending ICMP error, the details are in the error queue.
+                    continue
+                port = self._parse_payload(data)
+                if port is None or sender[:2] != (self._peer, port):
+                    continue
+                if scan.results.get(port) is not PortState.OPEN:
+                    scan.answered[port] = scan.attempts.get(port, 1)
+                    if scan.attempts.get(port) == 1:
+                        self.rtt.add_sample(time.monotonic() - scan.sent_at[port])
+                self._settle(scan, port, PortState.OPEN)
+            if self._with_error_queue:
+                self._read_errors(scan, sock)
+
+    def _send(self, scan, sock, port):
+        payload = self._build_payload(port)
+        while True:
+            try:
+                sock.sendto(payload, (self.addr, port))
+                if port not in scan.sent_at and port not in scan.results:
+                    scan.outstanding[port] = time.monotonic()
+                scan.sent_at.setdefault(port, time.monotonic())
+                scan.sockets[port] = sock
+                scan.attempts[port] = scan.attempts.get(port, 0) + 1
+                if scan.attempts[port] <= self.hedges:
+                    self._schedule_hedge(scan, port, scan.delay)
+                return
+            except (BlockingIOError, InterruptedError):
+                self._receive(scan, 0.01)
+            except OSError:
+                return
+
+    def _answered(self, scan, port):
+        return port in scan.results
+
+    def _resend(self, scan, port):
+        self._send(scan, scan.sockets[port], port)
+
+    def _wait(self, scan, until, until_answered=False):
+        """Receive answers and send due duplicates until the given time."""
+        while not (until_answered and len(scan.results) >= len(scan.sent_at)):
+            self._expire(scan.outstanding, scan.timeout)
+            self._send_hedges(scan)
+            now = time.monotonic()
+            if now >= until:
+                return
+            wake = min(until, scan.due[0][0]) if scan.due else until
+            self._receive(scan, wake - now)
+
+    def scan(self, ports):
+        """Probe every port, returns a dict mapping answered ports to their PortState.
+
+        Ports which neither echoed their token nor triggered an ICMP error are
+        missing from the dict.
+        """
+        timeout = self.rtt.timeout(self.timeout)
+        scan = _Scan(
+            selector=selectors.DefaultSelector(),
+            delay=self.hedge_delay or self.rtt.hedge_delay(timeout, self.hedges),
+            timeout=timeout,
+        )
+        socks = [self._open_socket() for _ in range(self.sockets)]
+        try:
+            for sock in socks:
+                scan.selector.register(sock, selectors.EVENT_READ)
+            for index, port in enumerate(ports):
+                self._wait(scan, time.monotonic() + self.limiter.take())
+                self._send(scan, socks[index % len(socks)], port)
+                self._receive(scan, 0)
+            self._wait(scan, time.monotonic() + timeout, until_answered=True)
+        finally:
+            scan.selector.close()
+            for sock in socks:
+                sock.close()
+        for _ in scan.outstanding:
+            self.limiter.report(True)
+        for port, attempts in scan.attempts.items():
+            state = scan.results.get(port, PortState.FILTERED)
+            self.stats.record(
+                state is not PortState.FILTERED, scan.answered.get(port, attempts)
+            )
+        return scan.results
+
+    def sweep(self, ports):
+        """Check all ports, yields (port, PortState) tuples in the order of ``ports``."""
+        ports = tuple(ports)
+        results = self.scan(ports)
+        for port in ports:
+            yield port, results.get(port, PortState.FILTERED)
@@ -0,0 +1,93 @@
+import multiprocessing
+import signal
+
+_executor = None
+
+
+def _init_worker():
+    """Leave Ctrl-C handling to the main process, it terminates the pool."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Executor:
+    """A process pool shared by all checks of a single run.
+
+    The underlying pool is only forked once it is actually needed and is
+    reused by every caller until shutdown() is called. Callers about to use
+    it from threads should start() it first, forking a process while other
+    threads hold locks can leave the children deadlocked.
+    """
+
+    DEFAULT_WORKERS = None
+    DEFAULT_CHUNKSIZE = 1
+
+    def __init__(self, workers=DEFAULT_WORKERS, chunksize=DEFAULT_CHUNKSIZE):
+        self.workers = workers
+        self.chunksize = max(1, int(chunksize))
+        self._pool = None
+
+    @property
+    def pool(self):
+        return self.start()
+
+    def start(self):
+        """Fork the worker processes unless they are running, returns the pool."""
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                processes=self.workers, initializer=_init_worker
+            )
+        return self._pool
+
+    def imap(self, func, iterable, chunksize=None):
+        """Apply func to each element of iterable, yields results in order."""
+        return self.pool.imap(func, iterable, chunksize=chunksize or self.chunksize)
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes.
+
+        With wait set to True pending tasks are finished first, otherwise the
+        workers are terminated right away.
+        """
+        if self._pool is None:
+            return
+        if wait:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=exc_type is None)
+
+    def __getstate__(self):
+        # Checks holding an executor get pickled into the workers, the pool
+        # itself has to stay in the process which owns it.
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+
+def configure(workers=Executor.DEFAULT_WORKERS, chunksize=Executor.DEFAULT_CHUNKSIZE):
+    """Replace the shared executor with one using the given settings."""
+    global _executor
+    shutdown()
+    _executor = Executor(workers=workers, chunksize=chunksize)
+    return _executor
+
+
+def get():
+    """Return the shared executor, creating it with default settings if needed."""
+    global _executor
+    if _executor is None:
+        _executor = Executor()
+    return _executor
+
+
+def shutdown(wait=True):
+    """Shut down the shared executor, if there is one."""
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
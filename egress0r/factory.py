@@ -1,6 +1,6 @@
 import traceback
 
-from egress0r import sanity
+from egress0r import executor, ratelimit, rtt, sanity
 from egress0r.checks import (
     FTPCheck,
     HTTPVerbsCheck,
@@ -13,6 +13,45 @@ from egress0r.checks.dns_ import Query
 from egress0r.payload import DNSExfilPayload, ExfilPayload, SMTPExfilPayload
 
 
+def build_executor(config):
+    """Configure the executor shared by all checks of this run."""
+    config = config or {}
+    return executor.configure(
+        workers=config.get("workers", executor.Executor.DEFAULT_WORKERS),
+        chunksize=int(
+            config.get("chunksize", None) or executor.Executor.DEFAULT_CHUNKSIZE
+        ),
+    )
+
+
+def build_timing(config):
+    """Configure the round trip time estimators shared by all checks of this run."""
+    config = config or {}
+    rtt.configure(
+        enabled=bool(config.get("adaptive_timeouts", False)),
+        min_timeout=float(
+            config.get("min_timeout", rtt.RTTEstimator.DEFAULT_MIN_TIMEOUT)
+        ),
+        min_samples=int(
+            config.get("min_samples", rtt.RTTEstimator.DEFAULT_MIN_SAMPLES)
+        ),
+        hedge_percentile=float(
+            config.get("hedge_percentile", rtt.RTTEstimator.DEFAULT_HEDGE_PERCENTILE)
+        ),
+    )
+
+
+def build_rate_limit(config):
+    """Configure the rate limiter shared by all checks of this run."""
+    config = config or {}
+    return ratelimit.configure(
+        rate=config.get("rate", ratelimit.TokenBucket.DEFAULT_RATE),
+        burst=config.get("burst", None),
+        min_rate=config.get("min_rate", ratelimit.TokenBucket.DEFAULT_MIN_RATE),
+        adaptive=bool(config.get("adaptive", True)),
+    )
+
+
 def build_smtp_exfil_payload(config):
     """Build an SMTPExfilPayload object with the given config."""
     return SMTPExfilPayload(
@@ -66,8 +105,9 @@ def build_dns_exfil_payload(config):
         domain=config["domain"],
         record_type=config["record_type"],
         nameserver=config["nameserver"],
-        chunk_size=int(config.get("chunk_size", DNSExfilPayload.DEFAULT_CHUNK_SIZE)),
+        chunk_size=config.get("chunk_size", DNSExfilPayload.DEFAULT_CHUNK_SIZE),
         max_chunks=int(config.get("max_chunks", DNSExfilPayload.DEFAULT_MAX_CHUNKS)),
+        encoding=config.get("encoding", DNSExfilPayload.DEFAULT_ENCODING),
     )
 
 
@@ -102,7 +142,10 @@ def build_dns(config, overrides=None):
         config.update(overrides)
 
     queries = build_dns_queries(config["queries"])
+    exfil = config.get("exfil") or {}
+    ingress = config.get("ingress") or {}
     payload = None
+    exfil_error = None
     try:
         if all(
             (
@@ -115,11 +158,25 @@ def build_dns(config, overrides=None):
             payload = build_dns_exfil_payload(config["exfil"])
     except (KeyError, AttributeError, TypeError):
         pass
+    except ValueError as e:
+        exfil_error = str(e)
     return DNSCheck(
         dns_servers=config["servers"],
         queries=queries,
         timeout=int(config.get("timeout", DNSCheck.DEFAULT_TIMEOUT)),
+        concurrency=int(config.get("concurrency", DNSCheck.DEFAULT_CONCURRENCY)),
         exfil_payload=payload,
+        exfil_error=exfil_error,
+        exfil_window=int(exfil.get("window", DNSCheck.DEFAULT_EXFIL_WINDOW)),
+        exfil_retries=int(exfil.get("retries", DNSCheck.DEFAULT_EXFIL_RETRIES)),
+        transports=config.get("transports") or DNSCheck.DEFAULT_TRANSPORTS,
+        exfil_transport=exfil.get("transport", DNSCheck.DEFAULT_EXFIL_TRANSPORT),
+        ingress_record=ingress.get("record"),
+        ingress_count=int(ingress.get("count", DNSCheck.DEFAULT_INGRESS_COUNT)),
+        ingress_payload_size=int(
+            ingress.get("payload_size", DNSCheck.DEFAULT_INGRESS_PAYLOAD_SIZE)
+        ),
+        ingress_window=int(ingress.get("window", DNSCheck.DEFAULT_INGRESS_WINDOW)),
         with_ipv4=sanity.HAS_IPV4_ADDR,
         with_ipv6=sanity.HAS_IPV6_ADDR,
     )
@@ -139,6 +196,27 @@ def build_port(config, overrides=None):
         with_udp=config.get("with_tcp", PortCheck.DEFAULT_WITH_UDP),
         with_ipv4=sanity.HAS_IPV4_ADDR,
         with_ipv6=sanity.HAS_IPV6_ADDR,
+        engine=config.get("engine", PortCheck.DEFAULT_ENGINE),
+        concurrency=int(config.get("concurrency", PortCheck.DEFAULT_CONCURRENCY)),
+        executor=executor.get(),
+        tcp_method=config.get("tcp_method", PortCheck.DEFAULT_TCP_METHOD),
+        syn_rate=int(config.get("syn_rate", PortCheck.DEFAULT_SYN_RATE)),
+        udp_method=config.get("udp_method", PortCheck.DEFAULT_UDP_METHOD),
+        report=config.get("report", PortCheck.DEFAULT_REPORT),
+        port_spec=config.get("ports", None),
+        order=config.get("order", PortCheck.DEFAULT_ORDER),
+        seed=config.get("seed", None),
+        checkpoint_file=config.get("checkpoint_file", None),
+        checkpoint_interval=int(
+            config.get("checkpoint_interval", PortCheck.DEFAULT_CHECKPOINT_INTERVAL)
+        ),
+        resume=config.get("resume", False),
+        sample_size=int(config.get("sample_size", PortCheck.DEFAULT_SAMPLE_SIZE)),
+        sample_confidence=float(
+            config.get("sample_confidence", PortCheck.DEFAULT_SAMPLE_CONFIDENCE)
+        ),
+        udp_hedges=int(config.get("udp_hedges", PortCheck.DEFAULT_UDP_HEDGES)),
+        udp_hedge_delay=config.get("udp_hedge_delay", None),
     )
 
 
@@ -162,12 +240,23 @@ def build_icmp(config, overrides=None):
         exfil_payload = build_icmp_exfil_payload(config["exfil"])
     except (KeyError, AttributeError):
         traceback.print_exc()
+    exfil = config.get("exfil") or {}
     return ICMPCheck(
         target_hosts=config["target_hosts"],
         timeout=int(config.get("timeout", ICMPCheck.DEFAULT_TIMEOUT)),
         exfil_payload=exfil_payload,
         with_ipv4=sanity.HAS_IPV4_ADDR,
         with_ipv6=sanity.HAS_IPV6_ADDR,
+        hedges=int(config.get("hedges", ICMPCheck.DEFAULT_HEDGES)),
+        hedge_delay=config.get("hedge_delay", None),
+        exfil_window=int(exfil.get("window", ICMPCheck.DEFAULT_EXFIL_WINDOW)),
+        exfil_retries=int(exfil.get("retries", ICMPCheck.DEFAULT_EXFIL_RETRIES)),
+        backend=config.get("backend", ICMPCheck.DEFAULT_BACKEND),
+        discover_payload_size=config.get(
+            "discover_payload_size", ICMPCheck.DEFAULT_DISCOVER_PAYLOAD_SIZE
+        ),
+        max_payload_size=config.get("max_payload_size", None),
+        burst=int(config.get("burst", ICMPCheck.DEFAULT_BURST)),
     )
 
 
@@ -1,7 +1,9 @@
 import io
+import math
 import os
 
 from egress0r import constants
+from egress0r.encoding import ENCODERS
 
 
 class ExfilPayload:
@@ -86,11 +88,23 @@ class ExfilPayload:
 
 
 class DNSExfilPayload(ExfilPayload):
+    """Payload exfiltrated in the names of DNS queries.
+
+    Chunks are encoded with one of VALID_ENCODINGS and split into labels of
+    at most MAX_LABEL_LENGTH characters in front of domain. With a
+    chunk_size of "auto" every chunk is as large as a single query
+    permits, leaving room for a label with the index of the chunk.
+    """
 
     DEFAULT_READ_MODE = "rb"
     DEFAULT_RECORD_TYPE = "A"
     DEFAULT_CHUNK_SIZE = 30
     DEFAULT_MAX_CHUNKS = 30
+    DEFAULT_ENCODING = "hex"
+    VALID_ENCODINGS = tuple(ENCODERS)
+    AUTO_CHUNK_SIZE = "auto"
+    MAX_LABEL_LENGTH = 63
+    MAX_QNAME_LENGTH = 253
 
     def __init__(
         self,
@@ -101,14 +115,59 @@ class DNSExfilPayload(ExfilPayload):
         read_mode=DEFAULT_READ_MODE,
         chunk_size=DEFAULT_CHUNK_SIZE,
         max_chunks=DEFAULT_MAX_CHUNKS,
+        encoding=DEFAULT_ENCODING,
     ):
+        if encoding not in self.VALID_ENCODINGS:
+            raise ValueError(
+                f"DNSExfilPayload expects argument encoding "
+                f"to be one of {self.VALID_ENCODINGS}, got {encoding!r}"
+            )
+        self.domain = domain.rstrip(".")
+        self.encoding = encoding
+        self.encoder = ENCODERS[encoding]()
+        # Room for the index label of the last chunk and its dot.
+        capacity = self.capacity(len(str(int(max_chunks))) + 1)
+        if chunk_size == self.AUTO_CHUNK_SIZE:
+            chunk_size = capacity
+        elif int(chunk_size) > capacity:
+            raise ValueError(
+                f"DNSExfilPayload expects argument chunk_size to be at most "
+                f"{capacity} for {encoding} encoded queries under {domain!r}, "
+                f"got {chunk_size!r}"
+            )
         super().__init__(
             filename, read_mode, chunk_size=int(chunk_size), max_chunks=int(max_chunks)
         )
-        self.domain = domain
         self.record_type = record_type
         self.nameserver = nameserver
 
+    def _qname_length(self, size):
+        """Length of the labels encoding size bytes, including their dots."""
+        length = self.encoder.encoded_length(size)
+        return length + math.ceil(length / self.MAX_LABEL_LENGTH)
+
+    def capacity(self, prefix_length=0):
+        """Return how many bytes fit into the name of a single query.
+
+        prefix_length is the length of the labels in front of the data,
+        including their dots.
+        """
+        budget = self.MAX_QNAME_LENGTH - len(self.domain) - prefix_length
+        size = 0
+        while self._qname_length(size + 1) <= budget:
+            size += 1
+        return size
+
+    def labels(self, data):
+        """Encode data, returns a list of labels."""
+        encoded = self.encoder.encode(data)
+        step = self.MAX_LABEL_LENGTH
+        return [encoded[i : i + step] for i in range(0, len(encoded), step)]
+
+    def qname(self, data, *prefix):
+        """Return the name of the query carrying data under domain."""
+        return ".".join([*prefix, *self.labels(data), self.domain])
+
 
 class SMTPExfilPayload(ExfilPayload):
 
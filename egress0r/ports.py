@@ -0,0 +1,234 @@
+import bisect
+import functools
+import os
+import random
+import re
+from array import array
+
+from egress0r.constants import data_dir
+
+PORT_MIN = 1
+PORT_MAX = 65535
+RANKED_PORTS_FILE = "ranked-ports.txt"
+SPEC_ITEM_REGEX = r"(top:\d+|\d+(-\d+)?)"
+SPEC_REGEX = rf"^\s*{SPEC_ITEM_REGEX}(\s*,\s*{SPEC_ITEM_REGEX})*\s*$"
+
+
+class PortSet:
+    """An immutable, ascending set of ports stored as merged ranges.
+
+    Supports len(), indexing, iteration and membership tests without
+    materializing the individual ports, the whole port space is a single range.
+    """
+
+    def __init__(self, ports=()):
+        ranges = []
+        for start, stop in sorted(_as_ranges(ports)):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], stop)
+            else:
+                ranges.append([start, stop])
+        self._ranges = tuple((start, stop) for start, stop in ranges)
+        self._offsets = []
+        total = 0
+        for start, stop in self._ranges:
+            self._offsets.append(total)
+            total += stop - start
+        self._length = total
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Build a PortSet from a port spec like "1-1024,3306,8000-8100,top:500".
+
+        Items are separated by commas, each item being either a single port,
+        an inclusive range of ports or top:N, the N most common ports according
+        to the ranked port index shipped with egress0r. N can't exceed the
+        number of ports the index actually ranks.
+        """
+        if not re.match(SPEC_REGEX, spec):
+            raise ValueError(f"Invalid port spec {spec!r}")
+        ranges = []
+        for item in spec.split(","):
+            item = item.strip()
+            if item.startswith("top:"):
+                count = int(item[4:])
+                if not 1 <= count <= ranked_port_count():
+                    raise ValueError(
+                        f"Invalid item {item!r} in port spec {spec!r}, expected "
+                        f"top:N with N between 1 and {ranked_port_count()}"
+                    )
+                ranges.extend((port, port + 1) for port in top_ports(count))
+                continue
+            start, _, end = item.partition("-")
+            start = int(start)
+            end = int(end or start)
+            if not PORT_MIN <= start <= end <= PORT_MAX:
+                raise ValueError(f"Invalid port range {item!r} in port spec {spec!r}")
+            ranges.append((start, end + 1))
+        return cls(ranges)
+
+    @property
+    def ranges(self):
+        """The (start, stop) ranges making up the set, stop being exclusive."""
+        return self._ranges
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("PortSet index out of range")
+        position = bisect.bisect_right(self._offsets, index) - 1
+        return self._ranges[position][0] + index - self._offsets[position]
+
+    def __iter__(self):
+        for start, stop in self._ranges:
+            yield from range(start, stop)
+
+    def __contains__(self, port):
+        position = bisect.bisect_right(self._ranges, (port, PORT_MAX + 1)) - 1
+        return position >= 0 and port < self._ranges[position][1]
+
+    def __repr__(self):
+        ranges = ", ".join(
+            str(start) if stop - start == 1 else f"{start}-{stop - 1}"
+            for start, stop in self._ranges
+        )
+        return f"{self.__class__.__qualname__}({ranges})"
+
+
+class PortPermutation:
+    """Iterate over a sequence of ports in a pseudo-random order.
+
+    The order is a walk through the multiplicative group of integers modulo
+    the smallest prime p above len(ports): starting at a random element and
+    repeatedly multiplying by a random generator of the group visits every
+    value in 1..p-1 exactly once, values beyond the sequence are skipped.
+    Only the start, the generator and p are stored, so memory use doesn't
+    depend on the number of ports. Equal seeds give equal orders, without a
+    seed one is picked at random and exposed as ``seed`` for later reruns.
+    """
+
+    def __init__(self, ports, seed=None):
+        self.ports = ports
+        if seed is None:
+            seed = random.SystemRandom().randint(0, 2**32 - 1)
+        self.seed = seed
+        rng = random.Random(seed)
+        self._prime = _next_prime(len(ports))
+        self._generator = _random_generator(self._prime, rng)
+        self._start = rng.randint(1, self._prime - 1)
+
+    def __len__(self):
+        return len(self.ports)
+
+    def __iter__(self):
+        length = len(self.ports)
+        if length < 2:
+            yield from self.ports
+            return
+        value = self._start
+        for _ in range(self._prime - 1):
+            if value <= length:
+                yield self.ports[value - 1]
+            value = value * self._generator % self._prime
+
+
+def _is_prime(number):
+    if number < 2:
+        return False
+    divisor = 2
+    while divisor * divisor <= number:
+        if number % divisor == 0:
+            return False
+        divisor += 1
+    return True
+
+
+def _next_prime(number):
+    """Return the smallest prime greater than number."""
+    candidate = number + 1
+    while not _is_prime(candidate):
+        candidate += 1
+    return candidate
+
+
+def _prime_factors(number):
+    factors = set()
+    divisor = 2
+    while divisor * divisor <= number:
+        while number % divisor == 0:
+            factors.add(divisor)
+            number //= divisor
+        divisor += 1
+    if number > 1:
+        factors.add(number)
+    return factors
+
+
+def _random_generator(prime, rng):
+    """Pick a random primitive root of the multiplicative group modulo prime."""
+    if prime == 2:
+        return 1
+    factors = _prime_factors(prime - 1)
+    while True:
+        candidate = rng.randint(2, prime - 1)
+        if all(pow(candidate, (prime - 1) // q, prime) != 1 for q in factors):
+            return candidate
+
+
+def _as_ranges(ports):
+    """Turn an iterable of ports or (start, stop) tuples into (start, stop) tuples."""
+    for item in ports:
+        if isinstance(item, tuple):
+            yield item
+        else:
+            yield item, item + 1
+
+
+@functools.lru_cache(maxsize=None)
+def read_port_file(filename):
+    """Read a file of one port per line from the data directory, once.
+    Lines which aren't a valid port are skipped.
+    """
+    ports = []
+    with open(os.path.join(data_dir, filename)) as fin:
+        for line in fin.readlines():
+            try:
+                port = int(line.strip())
+                if PORT_MIN <= port <= PORT_MAX:
+                    ports.append(port)
+            except (ValueError, TypeError):
+                pass
+    return tuple(ports)
+
+
+@functools.lru_cache(maxsize=None)
+def ranked_ports():
+    """Return all ports ordered from most to least common as a read-only array.
+
+    The ports listed in the ranked port file come first, all remaining ports
+    follow in ascending order. The index is built once per process.
+    """
+    listed = read_port_file(RANKED_PORTS_FILE)
+    seen = bytearray(PORT_MAX + 1)
+    ranked = array("H")
+    for port in listed:
+        if not seen[port]:
+            seen[port] = 1
+            ranked.append(port)
+    ranked.extend(port for port in range(PORT_MIN, PORT_MAX + 1) if not seen[port])
+    return memoryview(ranked.tobytes()).cast("H")
+
+
+@functools.lru_cache(maxsize=None)
+def ranked_port_count():
+    """Return how many ports the ranked port file actually ranks."""
+    return len(set(read_port_file(RANKED_PORTS_FILE)))
+
+
+def top_ports(count):
+    """Return the count most common ports, most common first."""
+    return ranked_ports()[:count]
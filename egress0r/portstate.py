@@ -0,0 +1,129 @@
+import enum
+import struct
+
+
+class PortState(enum.IntEnum):
+    """Outcome of a single port probe.
+
+    OPEN means the egress0r listener behind the port was reached, CLOSED that
+    the network actively rejected the probe with a TCP RST or an ICMP port
+    unreachable and FILTERED that the probe was dropped, rejected as
+    prohibited or never answered at all.
+    Only OPEN is truthy, so a PortState can be used wherever a bool was used.
+    """
+
+    OPEN = 1
+    CLOSED = 2
+    FILTERED = 3
+
+    def __bool__(self):
+        return self is PortState.OPEN
+
+
+class PortStateMatrix:
+    """Compact store of port probe results indexed by (ip_version, protocol, port).
+
+    Every (ip_version, protocol) pair is backed by a bytearray holding one
+    PortState value per port, 0 marking ports which weren't probed, so even
+    a full sweep of both protocols over IPv4 and IPv6 takes 256 KiB.
+    """
+
+    PORT_COUNT = 65536
+    _KEY_HEADER = struct.Struct("!BB")
+
+    def __init__(self):
+        self._states = {}
+
+    def __setitem__(self, index, state):
+        ip_version, protocol, port = index
+        key = (ip_version, protocol)
+        if key not in self._states:
+            self._states[key] = bytearray(self.PORT_COUNT)
+        self._states[key][port] = int(state)
+
+    def __getitem__(self, index):
+        """Return the PortState of the port, None if it wasn't probed."""
+        ip_version, protocol, port = index
+        states = self._states.get((ip_version, protocol))
+        if states is None or not states[port]:
+            return None
+        return PortState(states[port])
+
+    def __contains__(self, index):
+        return self[index] is not None
+
+    def keys(self):
+        """Return the (ip_version, protocol) pairs holding results."""
+        return tuple(self._states)
+
+    def ports(self, ip_version, protocol, state):
+        """Yield the ports of the given (ip_version, protocol) pair in the given state."""
+        states = self._states.get((ip_version, protocol), b"")
+        value = int(state)
+        start = states.find(value)
+        while start >= 0:
+            yield start
+            start = states.find(value, start + 1)
+
+    def count(self, ip_version, protocol, state, start=0, stop=PORT_COUNT):
+        """Count the ports in [start, stop) of the pair in the given state."""
+        states = self._states.get((ip_version, protocol), b"")
+        return states.count(int(state), start, stop)
+
+    def probed(self, ip_version, protocol, start=0, stop=PORT_COUNT):
+        """Count the ports in [start, stop) of the pair which have a result."""
+        states = self._states.get((ip_version, protocol))
+        if states is None:
+            return 0
+        return stop - start - states.count(0, start, stop)
+
+    def copy(self):
+        matrix = self.__class__()
+        matrix._states = {key: states[:] for key, states in self._states.items()}
+        return matrix
+
+    def to_bytes(self):
+        """Serialize the matrix, every pair is stored as a small header and its states."""
+        chunks = []
+        for (ip_version, protocol), states in self._states.items():
+            name = protocol.encode("ascii")
+            chunks.append(self._KEY_HEADER.pack(ip_version, len(name)) + name)
+            chunks.append(bytes(states))
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Restore a matrix serialized with to_bytes()."""
+        matrix = cls()
+        offset = 0
+        while offset < len(data):
+            ip_version, length = cls._KEY_HEADER.unpack_from(data, offset)
+            offset += cls._KEY_HEADER.size
+            protocol = data[offset : offset + length].decode("ascii")
+            offset += length
+            states = bytearray(data[offset : offset + cls.PORT_COUNT])
+            if len(states) != cls.PORT_COUNT:
+                raise ValueError("Truncated PortStateMatrix data")
+            offset += cls.PORT_COUNT
+            matrix._states[(ip_version, protocol)] = states
+        return matrix
+
+
+def collapse_ranges(ports):
+    """Collapse ascending ports into a compact string.
+
+    >>> collapse_ranges([80, 443, 8000, 8001, 8002])
+    '80, 443, 8000-8002'
+    """
+    ranges = []
+    start = end = None
+    for port in ports:
+        if end is not None and port == end + 1:
+            end = port
+            continue
+        if start is not None:
+            ranges.append(str(start) if start == end else f"{start}-{end}")
+        start = end = port
+    if start is not None:
+        ranges.append(str(start) if start == end else f"{start}-{end}")
+    return ", ".join(ranges)
@@ -0,0 +1,158 @@
+import threading
+import time
+
+_bucket = None
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Pace probes to a shared rate, backing off when the path starts dropping them.
+
+    Every probe takes a token, tokens refill at ``rate`` per second up to
+    ``burst``, a tenth of the rate by default. take() never blocks, it
+    reserves the token and returns how long the caller has to wait before
+    sending, so threads, processes feeding a pool and coroutines can all
+    share one bucket.
+
+    With ``adaptive`` set, the rate follows AIMD like TCP congestion control:
+    outcomes are reported in windows of WINDOW probes, if the share of lost
+    probes in a window spikes above the loss seen so far, the rate is halved,
+    otherwise it grows by a twentieth of the configured rate. A steady loss
+    rate, e.g. a port range which is filtered, doesn't slow probing down.
+    The rate never drops below ``min_rate`` nor exceeds the configured rate.
+
+    A rate of None disables pacing, probes are still counted so the
+    effective rate can be measured with meter().
+    """
+
+    WINDOW = 64
+    DECREASE = 0.5
+    INCREASE = 1 / 20
+    SPIKE_MARGIN = 0.1
+    BASELINE_ALPHA = 1 / 4
+    DEFAULT_RATE = None
+    DEFAULT_MIN_RATE = 10
+
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        burst=None,
+        min_rate=DEFAULT_MIN_RATE,
+        adaptive=True,
+    ):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1, (rate or 0) / 10)
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.adaptive = adaptive
+        self.tokens = self.burst
+        self.sent = 0
+        self._updated = time.monotonic()
+        self._outcomes = 0
+        self._losses = 0
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate is not None
+
+    def take(self, tokens=1):
+        """Reserve tokens, returns the seconds to wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.enabled:
+                elapsed = now - self._updated
+                self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+                self._updated = now
+                self.tokens -= tokens
+                if self.tokens < 0:
+                    wait = -self.tokens / self.rate
+            self.sent += tokens
+            return wait
+
+    def acquire(self, tokens=1):
+        """Take tokens, sleeping until they are available."""
+        wait = self.take(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def report(self, lost):
+        """Feed the outcome of a probe, lost being True if it timed out."""
+        if not self.enabled or not self.adaptive:
+            return
+        with self._lock:
+            self._outcomes += 1
+            self._losses += bool(lost)
+            if self._outcomes < self.WINDOW:
+                return
+            loss = self._losses / self._outcomes
+            self._outcomes = self._losses = 0
+            if self._baseline is not None and loss > self._baseline + self.SPIKE_MARGIN:
+                self.rate = max(self.min_rate, self.rate * self.DECREASE)
+            else:
+                self.rate = min(
+                    self.max_rate, self.rate + self.max_rate * self.INCREASE
+                )
+            if self._baseline is None:
+                self._baseline = loss
+            else:
+                self._baseline += self.BASELINE_ALPHA * (loss - self._baseline)
+
+    def meter(self):
+        """Start measuring the rate probes are sent at, returns a RateMeter."""
+        return RateMeter(self)
+
+
+class RateMeter:
+    """Measure the effective rate of the probes taken from a bucket since creation."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._sent = bucket.sent
+        self._started = time.monotonic()
+
+    @property
+    def sent(self):
+        return self.bucket.sent - self._sent
+
+    @property
+    def rate(self):
+        """Probes per second, None if nothing was sent yet."""
+        elapsed = time.monotonic() - self._started
+        if not self.sent or elapsed <= 0:
+            return None
+        return self.sent / elapsed
+
+
+def paced(iterable, bucket=None):
+    """Yield the items of iterable, each one after taking a token from bucket."""
+    bucket = bucket or get()
+    for item in iterable:
+        bucket.acquire()
+        yield item
+
+
+def configure(
+    rate=TokenBucket.DEFAULT_RATE,
+    burst=None,
+    min_rate=TokenBucket.DEFAULT_MIN_RATE,
+    adaptive=True,
+):
+    """Replace the bucket shared by all checks of this run."""
+    global _bucket
+    with _lock:
+        _bucket = TokenBucket(
+            rate=rate, burst=burst, min_rate=min_rate, adaptive=adaptive
+        )
+        return _bucket
+
+
+def get():
+    """Return the bucket shared by all checks, an unlimited one unless configured."""
+    global _bucket
+    with _lock:
+        if _bucket is None:
+            _bucket = TokenBucket()
+        return _bucket
@@ -0,0 +1,251 @@
+import collections
+import random
+import statistics
+import threading
+
+_estimators = {}
+_lock = threading.Lock()
+_settings = {
+    "enabled": False,
+    "min_timeout": 0.5,
+    "min_samples": 3,
+    "hedge_percentile": 0.9,
+}
+
+
+class RTTEstimator:
+    """Estimate probe round trip times the way TCP does (RFC 6298).
+
+    The smoothed round trip time (SRTT) and its variation (RTTVAR) are
+    updated with every successful probe, the derived timeout is
+    SRTT + 4 * RTTVAR. As long as fewer than ``min_samples`` samples were
+    collected, or if adaptive timeouts are disabled, the configured timeout
+    is used as is, otherwise it serves as the upper bound.
+
+    A bounded reservoir of samples is kept as well, its percentiles tell how
+    long to wait before hedging a probe with a duplicate. The wait is at least
+    HEDGE_MULTIPLIER times that percentile and min_timeout, so only probes
+    which are plausibly lost get duplicated.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+    GRANULARITY = 0.01
+    DEFAULT_MIN_TIMEOUT = 0.5
+    DEFAULT_MIN_SAMPLES = 3
+    DEFAULT_HEDGE_PERCENTILE = 0.9
+    HEDGE_MULTIPLIER = 2
+    RESERVOIR_SIZE = 128
+
+    def __init__(
+        self,
+        enabled=True,
+        min_timeout=DEFAULT_MIN_TIMEOUT,
+        min_samples=DEFAULT_MIN_SAMPLES,
+        hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+    ):
+        self.enabled = enabled
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self.hedge_percentile = hedge_percentile
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self._reservoir = []
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def add_sample(self, rtt):
+        """Feed the round trip time of a successful probe, in seconds."""
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(
+                    self.srtt - rtt
+                )
+                self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+            self.samples += 1
+            if len(self._reservoir) < self.RESERVOIR_SIZE:
+                self._reservoir.append(rtt)
+            else:
+                index = self._random.randrange(self.samples)
+                if index < self.RESERVOIR_SIZE:
+                    self._reservoir[index] = rtt
+
+    def timeout(self, upper_bound):
+        """Return the timeout to use for the next probe."""
+        with self._lock:
+            if not self.enabled or self.samples < self.min_samples:
+                return upper_bound
+            rto = self.srtt + max(self.GRANULARITY, self.K * self.rttvar)
+        return min(upper_bound, max(self.min_timeout, rto))
+
+    def percentile(self, fraction):
+        """Return the given percentile (0-1) of the sampled round trip times.
+        None as long as fewer than min_samples samples were collected.
+        """
+        with self._lock:
+            if self.samples < self.min_samples:
+                return None
+            ordered = sorted(self._reservoir)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def hedge_delay(self, upper_bound, hedges):
+        """Return how long to wait for an answer before sending a duplicate probe.
+
+        The attempts split upper_bound evenly. With adaptive timeouts enabled
+        and enough round trip times sampled, the delay shrinks to a multiple
+        of their hedge_percentile, but not below min_timeout.
+        """
+        delay = upper_bound / (hedges + 1)
+        observed = self.percentile(self.hedge_percentile)
+        if self.enabled and observed is not None:
+            floor = max(self.min_timeout, self.HEDGE_MULTIPLIER * observed)
+            delay = min(delay, floor)
+        return delay
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class LossStats:
+    """Count how many probes were answered right away, only once a duplicate
+    was sent or not at all, and how many duplicates it took.
+    """
+
+    def __init__(self):
+        self.first = 0
+        self.hedged = 0
+        self.lost = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def record(self, answered, attempts=1):
+        """Record a probe which took attempts datagrams to be answered, if at all."""
+        with self._lock:
+            if not answered:
+                self.lost += 1
+            elif attempts > 1:
+                self.hedged += 1
+            else:
+                self.first += 1
+            self.duplicates += max(0, attempts - 1)
+
+    @property
+    def total(self):
+        return self.first + self.hedged + self.lost
+
+    @property
+    def loss_rate(self):
+        return self.lost / self.total if self.total else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.first} answered right away, {self.hedged} after hedging, "
+            f"{self.lost} unanswered ({self.loss_rate:.1%} loss), "
+            f"{self.duplicates} duplicates sent"
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+_BurstStats = collections.namedtuple(
+    "_BurstStats", ["sent", "received", "min", "avg", "p50", "p99", "jitter"]
+)
+
+
+class BurstStats(_BurstStats):
+    """Loss, latency and jitter of a burst of probes, times in seconds.
+
+    Jitter is the mean difference between the round trip times of
+    consecutive answered probes, as in RFC 3550. The latency fields are
+    None if no probe was answered.
+    """
+
+    @classmethod
+    def from_samples(cls, rtts):
+        """Summarize the round trip times of a burst, in sending order, None
+        standing for probes which went unanswered.
+
+        >>> stats = BurstStats.from_samples([0.010, None, 0.030, 0.020])
+        >>> stats.loss, round(stats.avg, 3), round(stats.jitter, 3)
+        (0.25, 0.02, 0.015)
+        """
+        answered = [rtt for rtt in rtts if rtt is not None]
+        if not answered:
+            return cls(len(rtts), 0, None, None, None, None, None)
+        ordered = sorted(answered)
+
+        def percentile(fraction):
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+        deltas = [abs(b - a) for a, b in zip(answered, answered[1:])]
+        return cls(
+            sent=len(rtts),
+            received=len(answered),
+            min=ordered[0],
+            avg=statistics.fmean(answered),
+            p50=percentile(0.5),
+            p99=percentile(0.99),
+            jitter=statistics.fmean(deltas) if deltas else 0.0,
+        )
+
+    @property
+    def loss(self):
+        return 1 - self.received / self.sent if self.sent else 0.0
+
+    def __str__(self):
+        summary = f"{self.sent} sent, {self.loss:.1%} loss"
+        if self.received:
+            times = "/".join(
+                f"{value * 1000:.2f}"
+                for value in (self.min, self.avg, self.p50, self.p99)
+            )
+            summary += (
+                f", rtt min/avg/p50/p99 {times} ms, jitter {self.jitter * 1000:.2f} ms"
+            )
+        return summary
+
+
+def configure(
+    enabled=False,
+    min_timeout=RTTEstimator.DEFAULT_MIN_TIMEOUT,
+    min_samples=RTTEstimator.DEFAULT_MIN_SAMPLES,
+    hedge_percentile=RTTEstimator.DEFAULT_HEDGE_PERCENTILE,
+):
+    """Configure the estimators handed out by get(), drops all collected samples."""
+    with _lock:
+        _settings.update(
+            enabled=enabled,
+            min_timeout=min_timeout,
+            min_samples=min_samples,
+            hedge_percentile=hedge_percentile,
+        )
+        _estimators.clear()
+
+
+def get(*key):
+    """Return the shared estimator for key, e.g. get("tcp", "116.203.4.62").
+
+    Probes of the same kind to the same destination share one estimator.
+    """
+    with _lock:
+        if key not in _estimators:
+            _estimators[key] = RTTEstimator(**_settings)
+        return _estimators[key]
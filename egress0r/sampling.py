@@ -0,0 +1,167 @@
+import collections
+import math
+import random
+import statistics
+
+from egress0r.ports import PortSet
+from egress0r.portstate import PortState
+
+Stratum = collections.namedtuple("Stratum", ["ports", "samples"])
+Policy = collections.namedtuple(
+    "Policy",
+    ["name", "open", "sampled", "low", "high", "exceptions", "allowed", "escalated"],
+)
+
+DEFAULT_ALLOW = "default allow"
+DEFAULT_DENY = "default deny"
+DEFAULT_DENY_WITH_EXCEPTIONS = "default deny with exceptions"
+MIXED = "mixed"
+
+
+def wilson_interval(successes, trials, confidence=0.95):
+    """Return the Wilson score interval of a binomial proportion.
+
+    >>> [round(bound, 3) for bound in wilson_interval(32, 32)]
+    [0.893, 1.0]
+    >>> [round(bound, 3) for bound in wilson_interval(0, 32)]
+    [0.0, 0.107]
+    """
+    if not trials:
+        return 0.0, 1.0
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    ratio = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (ratio + z * z / (2 * trials)) / denominator
+    margin = (
+        z
+        * math.sqrt(ratio * (1 - ratio) / trials + z * z / (4 * trials * trials))
+        / denominator
+    )
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+class PortSampler:
+    """Draw a stratified random sample of a port set and classify the results.
+
+    The port set is split into strata of ``stratum_size`` consecutive ports,
+    ``sample_size`` random ports are drawn from each. The ``pinned`` ports,
+    e.g. the most common ones, are always probed as well, since that's where
+    the exceptions of a default deny policy usually are, but they don't count
+    towards the statistics of their stratum.
+
+    A stratum is allowed if the Wilson interval of its open ratio lies above
+    one half, denied if it lies below and inconclusive otherwise. Inconclusive
+    strata are meant to be probed exhaustively, their verdict is then exact.
+    """
+
+    DEFAULT_STRATUM_SIZE = 4096
+    DEFAULT_SAMPLE_SIZE = 32
+    DEFAULT_CONFIDENCE = 0.95
+
+    def __init__(
+        self,
+        ports,
+        pinned=(),
+        sample_size=DEFAULT_SAMPLE_SIZE,
+        confidence=DEFAULT_CONFIDENCE,
+        seed=None,
+        stratum_size=DEFAULT_STRATUM_SIZE,
+    ):
+        if not 0 < confidence < 1:
+            raise ValueError(
+                f"PortSampler expects confidence to be between 0 and 1, "
+                f"got {confidence!r}"
+            )
+        self.confidence = confidence
+        self.pinned = PortSet(p for p in pinned if p in ports)
+        rng = random.Random(seed)
+        self.strata = []
+        for offset in range(0, len(ports), stratum_size):
+            stratum = PortSet(
+                ports[i] for i in range(offset, min(offset + stratum_size, len(ports)))
+            )
+            candidates = [p for p in stratum if p not in self.pinned]
+            samples = rng.sample(candidates, min(sample_size, len(candidates)))
+            self.strata.append(Stratum(stratum, tuple(sorted(samples))))
+
+    @property
+    def ports(self):
+        """All ports to probe, the samples of every stratum and the pinned ports."""
+        samples = (port for stratum in self.strata for port in stratum.samples)
+        return PortSet(list(samples) + list(self.pinned))
+
+    @staticmethod
+    def _count(results, ip_version, protocol, ports):
+        """Count the open and the probed ports among ports."""
+        probed = opened = 0
+        for port in ports:
+            state = results[ip_version, protocol, port]
+            if state is not None:
+                probed += 1
+                opened += state is PortState.OPEN
+        return opened, probed
+
+    @staticmethod
+    def _exhausted(results, ip_version, protocol, stratum):
+        """Count the open ports of the stratum, None unless all of them were probed."""
+        opened = 0
+        for start, stop in stratum.ports.ranges:
+            if results.probed(ip_version, protocol, start, stop) != stop - start:
+                return None
+            opened += results.count(ip_version, protocol, PortState.OPEN, start, stop)
+        return opened
+
+    def verdict(self, results, ip_version, protocol, stratum):
+        """Return True if the stratum is allowed, False if denied, None if unsure."""
+        opened = self._exhausted(results, ip_version, protocol, stratum)
+        if opened is not None:
+            return opened * 2 > len(stratum.ports)
+        opened, probed = self._count(results, ip_version, protocol, stratum.samples)
+        low, high = wilson_interval(opened, probed, self.confidence)
+        if low > 0.5:
+            return True
+        if high < 0.5:
+            return False
+        return None
+
+    def inconclusive(self, results, ip_version, protocol):
+        """Return the strata which need to be probed exhaustively."""
+        return [
+            stratum
+            for stratum in self.strata
+            if self.verdict(results, ip_version, protocol, stratum) is None
+        ]
+
+    def classify(self, results, ip_version, protocol):
+        """Classify the policy of a sweep from its results, returns a Policy."""
+        verdicts = [
+            self.verdict(results, ip_version, protocol, stratum)
+            for stratum in self.strata
+        ]
+        samples = [port for stratum in self.strata for port in stratum.samples]
+        opened, sampled = self._count(results, ip_version, protocol, samples)
+        low, high = wilson_interval(opened, sampled, self.confidence)
+        escalated = sum(
+            self._exhausted(results, ip_version, protocol, stratum) is not None
+            for stratum in self.strata
+        )
+        allowed = PortSet(
+            stratum_range
+            for stratum, allow in zip(self.strata, verdicts)
+            if allow
+            for stratum_range in stratum.ports.ranges
+        )
+
+        if all(verdicts):
+            name = DEFAULT_ALLOW
+            exceptions = sorted(
+                list(results.ports(ip_version, protocol, PortState.CLOSED))
+                + list(results.ports(ip_version, protocol, PortState.FILTERED))
+            )
+        elif not any(v or v is None for v in verdicts):
+            exceptions = list(results.ports(ip_version, protocol, PortState.OPEN))
+            name = DEFAULT_DENY_WITH_EXCEPTIONS if exceptions else DEFAULT_DENY
+        else:
+            name = MIXED
+            exceptions = []
+        return Policy(name, opened, sampled, low, high, exceptions, allowed, escalated)
@@ -0,0 +1,106 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class _KeyedQueue:
+    """Funnel the items put for a key into a queue shared by all keys."""
+
+    def __init__(self, key, shared):
+        self.key = key
+        self.shared = shared
+
+    def put(self, item):
+        self.shared.put((self.key, item))
+
+
+class SweepScheduler:
+    """Run several sweeps at once while streaming their results in a stable order.
+
+    A source is a callable returning an iterable of (key, port, state) tuples,
+    a single source may produce results for several keys. Every source runs
+    in its own thread, results are buffered per key and yielded key by key in
+    the order the keys were passed in, so the output doesn't depend on which
+    sweep happens to finish first. Callers which don't care about the order
+    can have the results yielded as they arrive instead, nothing is buffered
+    in that case. Once the caller stops consuming the results, the sources
+    are stopped after their next result.
+    """
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self._sources = []
+
+    def add(self, keys, source):
+        """Register source as the producer of the results for keys."""
+        self._sources.append((tuple(keys), source))
+
+    @staticmethod
+    def _run_source(keys, source, buffers, stopped):
+        try:
+            for key, port, state in source():
+                if stopped.is_set():
+                    break
+                buffers[key].put((port, state))
+        except Exception as exc:
+            for key in keys:
+                buffers[key].put(_Failure(exc))
+        finally:
+            for key in keys:
+                buffers[key].put(_DONE)
+
+    def run(self, ordered=True):
+        """Start all sources, yields (key, port, state) tuples.
+
+        With ordered set to False results are yielded in the order they arrive.
+        """
+        if ordered:
+            buffers = {key: queue.Queue() for key in self.keys}
+        else:
+            shared = queue.Queue()
+            buffers = {key: _KeyedQueue(key, shared) for key in self.keys}
+        stopped = threading.Event()
+        for keys, source in self._sources:
+            thread = threading.Thread(
+                target=self._run_source,
+                args=(keys, source, buffers, stopped),
+                daemon=True,
+            )
+            thread.start()
+
+        try:
+            if ordered:
+                yield from self._collect(buffers)
+            else:
+                yield from self._drain(shared)
+        finally:
+            stopped.set()
+
+    def _collect(self, buffers):
+        for key in self.keys:
+            while True:
+                item = buffers[key].get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exc
+                port, state = item
+                yield key, port, state
+
+    def _drain(self, shared):
+        pending = len(self.keys)
+        while pending:
+            key, item = shared.get()
+            if item is _DONE:
+                pending -= 1
+                continue
+            if isinstance(item, _Failure):
+                raise item.exc
+            port, state = item
+            yield key, port, state
@@ -0,0 +1,80 @@
+import collections
+import threading
+
+
+class TargetPool:
+    """Equivalent reflectors of one address family sharing the probes of a sweep.
+
+    Ports are sharded across the healthy targets by port number, so every
+    target sees a similar mix of ports. A target is considered down once its
+    last WINDOW probes went unanswered although, judging by the answer rate
+    of the other targets, EXPECTED_ANSWERS answers were to be expected.
+    Sparse answers, e.g. on a network blocking all but a few ports, don't
+    take targets down. Down targets aren't picked anymore.
+    """
+
+    WINDOW = 64
+    EXPECTED_ANSWERS = 4
+
+    def __init__(self, addrs):
+        self.addrs = tuple(addrs)
+        self._windows = {
+            addr: collections.deque(maxlen=self.WINDOW) for addr in self.addrs
+        }
+        self._probes = dict.fromkeys(self.addrs, 0)
+        self._answers = dict.fromkeys(self.addrs, 0)
+        self._down = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.addrs)
+
+    @property
+    def healthy(self):
+        with self._lock:
+            return [addr for addr in self.addrs if addr not in self._down]
+
+    @property
+    def down(self):
+        with self._lock:
+            return [addr for addr in self.addrs if addr in self._down]
+
+    def is_down(self, addr):
+        with self._lock:
+            return addr in self._down
+
+    def pick(self, port):
+        """Return the healthy target responsible for port, None if all are down."""
+        healthy = self.healthy
+        if not healthy:
+            return None
+        return healthy[port % len(healthy)]
+
+    def shard(self, ports):
+        """Split ports among the healthy targets, returns a dict of lists."""
+        shards = collections.defaultdict(list)
+        for port in ports:
+            shards[self.pick(port)].append(port)
+        return dict(shards)
+
+    def record(self, addr, answered):
+        """Record the outcome of a probe sent to addr."""
+        with self._lock:
+            window = self._windows[addr]
+            window.append(bool(answered))
+            self._probes[addr] += 1
+            self._answers[addr] += bool(answered)
+            # Answers of one target can take others down, check all of them.
+            for target in self.addrs:
+                if self._silent(target):
+                    self._down.add(target)
+
+    def _silent(self, addr):
+        """Determine if addr went quiet while the others kept answering."""
+        window = self._windows[addr]
+        if addr in self._down or len(window) < self.WINDOW or any(window):
+            return False
+        others = [a for a in self.addrs if a != addr and a not in self._down]
+        probes = sum(self._probes[a] for a in others)
+        answers = sum(self._answers[a] for a in others)
+        return bool(probes) and answers * self.WINDOW / probes >= self.EXPECTED_ANSWERS
@@ -1,6 +1,10 @@
+import argparse
+import functools
+
 import colorama
 
-from egress0r import config, constants, factory, sanity
+from egress0r import config, constants, executor, factory, sanity
+from egress0r.message import MessageType
 
 
 def print_outcome(success_count, fail_count):
@@ -12,7 +16,17 @@ def print_outcome(success_count, fail_count):
     )
 
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check for egress filtering.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume an interrupted port sweep from its checkpoint_file",
+    )
+    return parser.parse_args()
+
+
+def main(args):
     print(constants.banner)
 
     is_sane = sanity.check()
@@ -20,6 +34,9 @@ def main():
         exit(1)
 
     cfg = config.load()
+    factory.build_executor(cfg.get("executor"))
+    factory.build_timing(cfg.get("timing"))
+    factory.build_rate_limit(cfg.get("rate_limit"))
 
     services = {
         "dns": factory.build_dns,
@@ -27,7 +44,9 @@ def main():
         "smtp": factory.build_smtp,
         "http": factory.build_http,
         "ftp": factory.build_ftp,
-        "port": factory.build_port,
+        "port": functools.partial(
+            factory.build_port, overrides={"resume": args.resume}
+        ),
     }
 
     success = 0
@@ -37,22 +56,26 @@ def main():
             service = service_factory(cfg[service_name])
             print(service.START_MESSAGE)
             for message in service.check():
+                message.print()
+                if message.type_ is MessageType.INFO:
+                    continue
                 if message:
                     success += 1
-                    message.print()
                 else:
                     fail += 1
-                    message.print()
             print()
 
+    executor.shutdown()
     print_outcome(success, fail)
 
 
 if __name__ == "__main__":
+    args = parse_args()
     colorama.init()
     try:
-        main()
+        main(args)
     except KeyboardInterrupt:
         pass
     finally:
+        executor.shutdown(wait=False)
         colorama.deinit()
@@ -1 +1 @@
-sudo sh -c 'venv/bin/python main.py'
+sudo sh -c 'venv/bin/python main.py "$@"' sh "$@"